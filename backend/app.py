@@ -1,20 +1,32 @@
 import os
+import gzip
+import time
+import io
+import hashlib
 import logging
+import threading
+import jwt as pyjwt
+import orjson
 import requests as http_requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import stripe
-from datetime import datetime
 from functools import wraps
+from concurrent.futures import Future
 
-from flask import Flask, jsonify, request
+from cachetools import TTLCache
+
+from flask import Flask, Request, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-from sqlalchemy import or_, func
+from sqlalchemy import or_, func, case, column, text
 
-from database import Base, engine, SessionLocal
-from models import Procedure, HcpcsCode, Icd10Procedure, MedicareUtilization, DataSyncLog
+from database import engine, db_session, init_db
+from models import Procedure, HcpcsCode, Icd10Procedure, MedicareUtilization, DataSyncLog, SEARCH_FTS_TABLES
 from text_extractor import TextExtractor
 from llm_service import LLMAnalyzer
 
@@ -28,31 +40,91 @@ logging.basicConfig(
 logger = logging.getLogger("medicheck")
 
 # ── App setup ────────────────────────────────────────────────
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Route jsonify() and request.get_json() through orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class UploadRequest(Request):
+    """
+    Buffer uploaded files in memory only.
+
+    Werkzeug spills parts over 500KB to a temp file by default; bills must
+    never touch disk, and MAX_CONTENT_LENGTH already caps the body at 16MB.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+app.request_class = UploadRequest
 
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173").split(",")
 CORS(app, origins=ALLOWED_ORIGINS)
 
+# memory:// is per process, so with N workers every limit is really N times
+# looser; point RATELIMIT_STORAGE_URI at Redis (redis://host:6379/0) in production.
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["120 per minute"],
-    storage_uri="memory://",
+    storage_uri=os.getenv("RATELIMIT_STORAGE_URI", "memory://"),
+    strategy="moving-window",
 )
 
 # Configuration
-UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Schema creation is a deploy step (`flask --app app init-db`); only run it on
+# import when explicitly asked, e.g. for local development.
+if os.getenv("AUTO_CREATE_SCHEMA") == "1":
+    init_db()
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Create any missing database tables."""
+    init_db()
+    print("Database tables created.")
 
-Base.metadata.create_all(bind=engine)
 
 SUPABASE_URL = os.getenv("SUPABASE_URL", "").rstrip("/")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
 
+
+def _pooled_session():
+    """requests.Session with a connection pool sized for concurrent workers.
+
+    Idempotent requests are retried twice on connection errors and 502-504;
+    POST/PATCH are never retried.
+    """
+    session = http_requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=(502, 503, 504)),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# One pooled session per upstream so TCP/TLS connections are reused across
+# requests instead of being re-established per call.
+supabase_http = _pooled_session()
+supabase_http.headers["apikey"] = SUPABASE_SERVICE_KEY
+nppes_http = _pooled_session()
+
 # ── Stripe config ─────────────────────────────────────────────
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
@@ -66,16 +138,201 @@ for env_key, credits in [("STRIPE_PRICE_SINGLE", 1), ("STRIPE_PRICE_5PACK", 5),
 
 stripe.api_key = STRIPE_SECRET_KEY
 
+# Shared across requests: TextExtractor is stateless and the OpenAI client is
+# thread-safe. The analyzer is built on first use so the app still starts
+# without OPENAI_API_KEY (only /process needs it).
+extractor = TextExtractor()
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                _analyzer = LLMAnalyzer()
+    return _analyzer
+
 
 # ── Helpers ──────────────────────────────────────────────────
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def allowed_extension(filename):
+    """Return the lowercased extension if it is an allowed upload type, else None."""
+    _, dot, ext = filename.rpartition('.')
+    ext = ext.lower()
+    return ext if dot and ext in ALLOWED_EXTENSIONS else None
+
+
+_LIKE_ESCAPE = str.maketrans({'\\': r'\\', '%': r'\%', '_': r'\_'})
 
 
 def _escape_like(q):
-    """Escape SQL LIKE wildcards in user input."""
-    return q.replace('%', r'\%').replace('_', r'\_')
+    """Escape SQL LIKE wildcards in user input (use with escape="\\")."""
+    return q.translate(_LIKE_ESCAPE)
+
+
+def _icontains(column, pattern):
+    """Case-insensitive LIKE for a pattern that is already lowercased.
+
+    SQLite's LIKE ignores ASCII case on its own, so skip the lower() on both
+    sides that ilike() would emit there; PostgreSQL gets a native ILIKE,
+    which the pg_trgm indexes serve.
+    """
+    if engine.dialect.name == "sqlite":
+        return column.like(pattern, escape="\\")
+    return column.ilike(pattern, escape="\\")
+
+
+def _iequals(column, value):
+    """Case-insensitive equality without lower() on SQLite.
+
+    The explicit COLLATE NOCASE matches the column's declared collation, so
+    the index still applies, and stays correct on databases created before
+    the columns were declared NOCASE.
+    """
+    if engine.dialect.name == "sqlite":
+        return column.collate("NOCASE") == value
+    return func.lower(column) == value.lower()
+
+
+_fts_present = set()
+
+
+def _has_search_fts(fts_table):
+    """Whether init_db has created the given FTS5 table.
+
+    Only a hit is remembered: a table created after startup (init_db run
+    against a live database) is picked up on the next search.
+    """
+    if fts_table not in _fts_present:
+        with engine.connect() as conn:
+            if conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+            ).first() is not None:
+                _fts_present.add(fts_table)
+    return fts_table in _fts_present
+
+
+def _text_search(model, fts_table, q):
+    """Case-insensitive substring filter for q over the model's search columns.
+
+    On SQLite this is an FTS5 trigram lookup (the tokenizer needs at least
+    three characters); otherwise, and for shorter queries, it falls back to
+    LIKE/ILIKE on each column.
+    """
+    if engine.dialect.name == "sqlite" and len(q) >= 3 and _has_search_fts(fts_table):
+        phrase = '"' + q.replace('"', '""') + '"'
+        matches = (
+            text(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH :fts_phrase")
+            .bindparams(fts_phrase=phrase)
+            .columns(column("rowid"))
+        )
+        return model.id.in_(matches)
+
+    pattern = f"%{_escape_like(q.lower())}%"
+    _, columns = SEARCH_FTS_TABLES[fts_table]
+    return or_(*(_icontains(getattr(model, name), pattern) for name in columns))
+
+
+def _data_version(db, *source_names):
+    """
+    Marker that changes whenever a source's rows may have changed: the id,
+    status, progress and finish time of its newest sync-log row. Every
+    writer leaves one -- a sync run when it starts and ends, a utilization
+    run after each committed batch, and the seeder when it loads.
+    """
+    row = (
+        db.query(
+            DataSyncLog.id,
+            DataSyncLog.status,
+            DataSyncLog.records_processed,
+            DataSyncLog.completed_at,
+        )
+        .filter(DataSyncLog.source_name.in_(source_names))
+        .order_by(DataSyncLog.started_at.desc(), DataSyncLog.id.desc())
+        .first()
+    )
+    return tuple(row) if row else None
+
+
+# Read-only lookups only change after a pipeline sync, so clients may reuse a
+# response briefly and then revalidate it with If-None-Match.
+CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=600"
+
+
+def _make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _with_cache_headers(resp, etag):
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = CACHE_CONTROL
+    return resp
+
+
+def _not_modified(etag):
+    """Return a 304 if the client already holds this ETag, else None."""
+    if request.if_none_match.contains_weak(etag):
+        return _with_cache_headers(app.response_class(status=304), etag)
+    return None
+
+
+# Verified tokens → (user, expires_at). A revoked token keeps working for at
+# most JWT_CACHE_TTL seconds; entries never outlive the token's own exp.
+# Failed verifications are not cached.
+JWT_CACHE_TTL = 30
+_jwt_cache = TTLCache(maxsize=10000, ttl=JWT_CACHE_TTL)
+_jwt_cache_lock = threading.Lock()
+
+# Asymmetric (ES256/RS256) Supabase tokens are verified locally against the
+# project's JWKS, fetched once and cached per process. Legacy HS256 tokens,
+# or an unreachable JWKS, fall back to asking /auth/v1/user.
+JWKS_ALGORITHMS = ["ES256", "RS256"]
+_jwks_client = (
+    pyjwt.PyJWKClient(f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json", cache_keys=True)
+    if SUPABASE_URL else None
+)
+
+
+def _verify_jwt_locally(token):
+    """Return the user described by a JWKS-verified token's claims.
+
+    Raises pyjwt.PyJWKClientError if no signing key is available and
+    pyjwt.InvalidTokenError if the token itself is bad.
+    """
+    signing_key = _jwks_client.get_signing_key_from_jwt(token)
+    claims = pyjwt.decode(
+        token,
+        signing_key.key,
+        algorithms=JWKS_ALGORITHMS,
+        audience="authenticated",
+        issuer=f"{SUPABASE_URL}/auth/v1",
+    )
+    # Same shape as the /auth/v1/user response for the fields we use.
+    # app_metadata reflects the role at token issue time.
+    user = {
+        "id": claims["sub"],
+        "email": claims.get("email"),
+        "role": claims.get("role"),
+        "app_metadata": claims.get("app_metadata") or {},
+        "user_metadata": claims.get("user_metadata") or {},
+    }
+    return user, float(claims["exp"])
+
+
+def _fetch_supabase_user(token):
+    """Ask Supabase who owns the token; return (user, None) or None."""
+    if not SUPABASE_SERVICE_KEY:
+        return None
+    resp = supabase_http.get(
+        f"{SUPABASE_URL}/auth/v1/user",
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=10,
+    )
+    if resp.status_code != 200:
+        return None
+    return resp.json(), None
 
 
 def verify_supabase_jwt():
@@ -83,20 +340,40 @@ def verify_supabase_jwt():
     auth_header = request.headers.get("Authorization", "")
     if not auth_header.startswith("Bearer "):
         return None
-    jwt = auth_header.split(" ", 1)[1]
-    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+    token = auth_header.split(" ", 1)[1]
+    if not SUPABASE_URL:
         return None
+
+    cache_key = hashlib.sha256(token.encode()).hexdigest()[:32]
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(cache_key)
+    if cached and cached[1] > time.time():
+        return cached[0]
+
     try:
-        resp = http_requests.get(
-            f"{SUPABASE_URL}/auth/v1/user",
-            headers={"Authorization": f"Bearer {jwt}", "apikey": SUPABASE_SERVICE_KEY},
-            timeout=10,
-        )
-        if resp.status_code == 200:
-            return resp.json()
+        if pyjwt.get_unverified_header(token).get("alg") in JWKS_ALGORITHMS:
+            try:
+                verified = _verify_jwt_locally(token)
+            except pyjwt.PyJWKClientError:
+                logger.warning("JWKS unavailable, verifying token remotely")
+                verified = _fetch_supabase_user(token)
+        else:
+            verified = _fetch_supabase_user(token)
+    except pyjwt.InvalidTokenError:
+        return None
     except Exception:
         logger.exception("JWT verification failed")
-    return None
+        return None
+    if not verified:
+        return None
+
+    user, exp = verified
+    now = time.time()
+    expires_at = min(exp or now + JWT_CACHE_TTL, now + JWT_CACHE_TTL)
+    if expires_at > now:
+        with _jwt_cache_lock:
+            _jwt_cache[cache_key] = (user, expires_at)
+    return user
 
 
 def require_auth(f):
@@ -128,17 +405,14 @@ def require_admin(f):
 # ── Supabase REST helpers (service_role key — bypasses RLS) ───
 
 def _sb_headers(content_type=None):
-    h = {
-        "apikey": SUPABASE_SERVICE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-    }
+    h = {"Authorization": f"Bearer {SUPABASE_SERVICE_KEY}"}
     if content_type:
         h["Content-Type"] = content_type
     return h
 
 
 def supabase_rest_get(table, params):
-    resp = http_requests.get(
+    resp = supabase_http.get(
         f"{SUPABASE_URL}/rest/v1/{table}",
         headers={**_sb_headers(), "Accept": "application/json"},
         params=params,
@@ -154,7 +428,7 @@ def supabase_rest_upsert(table, data, on_conflict=None):
     if on_conflict:
         headers["Prefer"] += ",resolution=merge-duplicates"
         params["on_conflict"] = on_conflict
-    resp = http_requests.post(
+    resp = supabase_http.post(
         f"{SUPABASE_URL}/rest/v1/{table}",
         headers=headers,
         params=params,
@@ -166,7 +440,7 @@ def supabase_rest_upsert(table, data, on_conflict=None):
 
 
 def supabase_rest_patch(table, match_params, data):
-    resp = http_requests.patch(
+    resp = supabase_http.patch(
         f"{SUPABASE_URL}/rest/v1/{table}",
         headers={**_sb_headers("application/json"), "Prefer": "return=representation"},
         params=match_params,
@@ -211,6 +485,38 @@ def check_and_deduct_credit(user_id):
     return False, "no_credits"
 
 
+@app.teardown_appcontext
+def remove_db_session(exc=None):
+    db_session.remove()
+
+
+# Search results compress 5-10x; level 1 gets most of that for little CPU.
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 1
+
+
+@app.after_request
+def gzip_json_response(response):
+    if (
+        response.mimetype != "application/json"
+        or response.status_code != 200
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    if "gzip" not in request.accept_encodings or response.content_length < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(response.get_data(), compresslevel=GZIP_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    # Same resource, different bytes: only a weak validator still holds.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
 @app.route("/")
 def root():
     return jsonify({"message": "MediCheck API - Medical Bill Analysis"})
@@ -219,7 +525,7 @@ def root():
 # ──────────────────────────────────────────────────────────────
 # /process  — single-step bill analysis endpoint
 #
-# Flow: receive file → extract text → DELETE file immediately
+# Flow: receive file → extract text in memory
 #       → run OpenAI analysis → return results
 #       Nothing is persisted on this server.
 # Requires: valid Supabase JWT
@@ -228,8 +534,11 @@ def root():
 @limiter.limit("10 per minute")
 @require_auth
 def process_bill():
-    filepath = None
     try:
+        # Refuse oversized uploads from the header alone, before reading the body
+        if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+            return jsonify({"error": "File too large. Maximum size is 16MB."}), 413
+
         # ── Credit gate ──
         user_id = request.user.get("id")
         allowed, reason = check_and_deduct_credit(user_id)
@@ -247,33 +556,27 @@ def process_bill():
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
 
-        if not allowed_file(file.filename):
+        file_type = allowed_extension(file.filename)
+        if not file_type:
             return jsonify({"error": "File type not allowed. Use PDF, JPG, or PNG"}), 400
 
-        # Save temporarily for text extraction only
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-        unique_filename = f"{timestamp}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(filepath)
-
-        file_type = filename.rsplit('.', 1)[1].lower()
+        # Trust the file's leading bytes over its name
+        head = file.stream.read(8)
+        file.stream.seek(0)
+        file_type = extractor.sniff_file_type(head)
+        if not file_type:
+            return jsonify({"error": "File content is not a valid PDF, JPG, or PNG"}), 400
 
-        # Extract text
-        extractor = TextExtractor()
-        raw_text = extractor.extract_text(filepath, file_type)
-
-        # ── Delete file immediately after extraction ──
-        os.remove(filepath)
-        filepath = None
+        # Extract straight from the in-memory upload stream; no extra copy is
+        # made and nothing is written to disk
+        raw_text = extractor.extract_text(file.stream, file_type)
 
         if not raw_text or not raw_text.strip():
             return jsonify({"error": "Could not extract text from this file. Try a clearer image or a text-based PDF."}), 422
 
         # Run full AI analysis pipeline
         logger.info("Analyzing bill for user %s", request.user.get("id", "unknown"))
-        analyzer = LLMAnalyzer()
-        results = analyzer.analyze_bill(raw_text)
+        results = get_analyzer().analyze_bill(raw_text)
 
         # Check if document was rejected (not a medical bill)
         if results.get("rejected"):
@@ -290,15 +593,12 @@ def process_bill():
             "complaint_email": results['complaint_email']
         }), 200
 
+    except RequestEntityTooLarge:
+        # Chunked uploads without a Content-Length are cut off while parsing
+        return jsonify({"error": "File too large. Maximum size is 16MB."}), 413
     except Exception as e:
         logger.exception("process_bill error")
         return jsonify({"error": "An internal error occurred. Please try again."}), 500
-    finally:
-        if filepath and os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except OSError:
-                pass
 
 
 # ──────────────────────────────────────────────────────────────
@@ -426,9 +726,9 @@ def admin_promote():
         return jsonify({"error": "email is required"}), 400
 
     try:
-        list_resp = http_requests.get(
+        list_resp = supabase_http.get(
             f"{SUPABASE_URL}/auth/v1/admin/users",
-            headers={"Authorization": f"Bearer {SUPABASE_SERVICE_KEY}", "apikey": SUPABASE_SERVICE_KEY},
+            headers=_sb_headers(),
             params={"filter": email},
             timeout=10,
         )
@@ -443,13 +743,9 @@ def admin_promote():
         app_metadata = target.get("app_metadata") or {}
         app_metadata["role"] = "admin"
 
-        update_resp = http_requests.put(
+        update_resp = supabase_http.put(
             f"{SUPABASE_URL}/auth/v1/admin/users/{target['id']}",
-            headers={
-                "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-                "apikey": SUPABASE_SERVICE_KEY,
-                "Content-Type": "application/json",
-            },
+            headers=_sb_headers("application/json"),
             json={"app_metadata": app_metadata},
             timeout=10,
         )
@@ -467,6 +763,27 @@ def admin_promote():
 # ──────────────────────────────────────────────────────────────
 # /procedures/search  — search procedure cost database
 # ──────────────────────────────────────────────────────────────
+
+# Search endpoints select plain column tuples and zip them with these names
+# (which double as the JSON keys) instead of hydrating ORM objects.
+PROCEDURE_FIELDS = (
+    "cpt_code", "description", "category", "medicare_rate", "typical_low",
+    "typical_high", "notes", "work_rvu", "non_fac_pe_rvu", "fac_pe_rvu",
+    "mp_rvu", "total_non_fac_rvu", "total_fac_rvu", "non_fac_fee", "fac_fee",
+    "conversion_factor", "global_period", "source", "source_year",
+)
+UTILIZATION_FIELDS = (
+    "avg_submitted_charge", "avg_allowed_amount", "avg_medicare_payment",
+    "p25_submitted_charge", "p75_submitted_charge", "total_providers",
+    "total_services", "total_beneficiaries",
+)
+HCPCS_FIELDS = ("hcpcs_code", "short_desc", "long_desc", "category", "source_year")
+ICD10_FIELDS = ("icd10_code", "short_desc", "long_desc", "source_year")
+
+
+def _columns(model, fields):
+    return [getattr(model, name) for name in fields]
+
 @app.route("/procedures/search", methods=["GET"])
 @limiter.limit("60 per minute")
 def procedures_search():
@@ -478,114 +795,90 @@ def procedures_search():
     except ValueError:
         limit = 20
 
-    db = SessionLocal()
-    try:
-        query = db.query(Procedure).filter(Procedure.modifier == "")
-
-        if q:
-            pattern = f"%{_escape_like(q)}%"
-            query = query.filter(
-                or_(
-                    func.lower(Procedure.cpt_code).like(func.lower(pattern)),
-                    func.lower(Procedure.description).like(func.lower(pattern)),
-                    func.lower(Procedure.category).like(func.lower(pattern)),
-                )
-            )
-
-        if category:
-            query = query.filter(
-                func.lower(Procedure.category) == category.lower()
-            )
-
-        results = query.order_by(
-            Procedure.medicare_rate.is_(None).asc(),
-            Procedure.category,
-            Procedure.cpt_code,
-        ).limit(limit).all()
-
-        items = []
-        for p in results:
-            item = {
-                "cpt_code":      p.cpt_code,
-                "description":   p.description,
-                "category":      p.category,
-                "medicare_rate": p.medicare_rate,
-                "typical_low":   p.typical_low,
-                "typical_high":  p.typical_high,
-                "notes":         p.notes,
-                "work_rvu":      p.work_rvu,
-                "non_fac_pe_rvu": p.non_fac_pe_rvu,
-                "fac_pe_rvu":    p.fac_pe_rvu,
-                "mp_rvu":        p.mp_rvu,
-                "total_non_fac_rvu": p.total_non_fac_rvu,
-                "total_fac_rvu": p.total_fac_rvu,
-                "non_fac_fee":   p.non_fac_fee,
-                "fac_fee":       p.fac_fee,
-                "conversion_factor": p.conversion_factor,
-                "global_period": p.global_period,
-                "source":        p.source,
-                "source_year":   p.source_year,
-            }
-
-            if include_utilization:
-                util = (
-                    db.query(MedicareUtilization)
-                    .filter_by(hcpcs_code=p.cpt_code, place_of_service="O")
-                    .first()
-                )
-                if not util:
-                    util = (
-                        db.query(MedicareUtilization)
-                        .filter_by(hcpcs_code=p.cpt_code)
-                        .first()
-                    )
-                if util:
-                    item["utilization"] = {
-                        "avg_submitted_charge": util.avg_submitted_charge,
-                        "avg_allowed_amount": util.avg_allowed_amount,
-                        "avg_medicare_payment": util.avg_medicare_payment,
-                        "p25_submitted_charge": util.p25_submitted_charge,
-                        "p75_submitted_charge": util.p75_submitted_charge,
-                        "total_providers": util.total_providers,
-                        "total_services": util.total_services,
-                        "total_beneficiaries": util.total_beneficiaries,
-                    }
-
-            items.append(item)
-
-        return jsonify({
-            "results": items,
-            "count": len(items),
-            "query": q,
-        })
-    finally:
-        db.close()
+    db = db_session()
+    etag = _make_etag(
+        "procedures/search", q, category, limit, include_utilization,
+        _data_version(db, "pfs", "seed"),
+        _data_version(db, "utilization") if include_utilization else None,
+    )
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    query = db.query(*_columns(Procedure, PROCEDURE_FIELDS)).filter(Procedure.modifier == "")
+
+    if q:
+        query = query.filter(_text_search(Procedure, "procedures_fts", q))
+
+    if category:
+        query = query.filter(_iequals(Procedure.category, category))
+
+    results = query.order_by(
+        Procedure.medicare_rate.is_(None).asc(),
+        Procedure.category,
+        Procedure.cpt_code,
+    ).limit(limit).all()
+
+    items = [dict(zip(PROCEDURE_FIELDS, row)) for row in results]
+
+    if include_utilization and items:
+        # One IN query for all utilization rows, preferring the office ("O")
+        # row for each code over the facility one.
+        util_by_code = {}
+        util_rows = db.query(
+            MedicareUtilization.hcpcs_code,
+            MedicareUtilization.place_of_service,
+            *_columns(MedicareUtilization, UTILIZATION_FIELDS),
+        ).filter(MedicareUtilization.hcpcs_code.in_([item["cpt_code"] for item in items]))
+        for code, pos, *values in util_rows:
+            if code not in util_by_code or pos == "O":
+                util_by_code[code] = dict(zip(UTILIZATION_FIELDS, values))
+        for item in items:
+            util = util_by_code.get(item["cpt_code"])
+            if util:
+                item["utilization"] = util
+
+    return _with_cache_headers(jsonify({
+        "results": items,
+        "count": len(items),
+        "query": q,
+    }), etag)
+
+
+# Category lists only change when the pipeline runs, so cache them keyed
+# by the source's latest completed sync.
+_categories_cache = TTLCache(maxsize=16, ttl=3600)
+_categories_cache_lock = threading.Lock()
 
 
 @app.route("/procedures/categories", methods=["GET"])
 def procedures_categories():
     """Return categories that have at least some priced procedures."""
-    db = SessionLocal()
-    try:
-        cats = (
-            db.query(
-                Procedure.category,
-                func.count(),
-                func.sum(func.iif(Procedure.medicare_rate.isnot(None), 1, 0)),
-            )
-            .filter(Procedure.modifier == "")
+    db = db_session()
+    cache_key = ("procedures", _data_version(db, "pfs", "seed"))
+    etag = _make_etag("procedures/categories", *cache_key)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    with _categories_cache_lock:
+        categories = _categories_cache.get(cache_key)
+
+    if categories is None:
+        priced = func.sum(case((Procedure.medicare_rate.isnot(None), 1), else_=0))
+        rows = (
+            db.query(Procedure.category)
+            .filter(Procedure.modifier == "", Procedure.category.isnot(None), Procedure.category != "")
             .group_by(Procedure.category)
+            .having(priced >= func.count() * 0.2)
             .order_by(Procedure.category)
             .all()
         )
-        return jsonify({
-            "categories": [
-                cat for cat, total, priced in cats
-                if cat and priced and total and (priced / total) >= 0.2
-            ]
-        })
-    finally:
-        db.close()
+        categories = [cat for (cat,) in rows]
+        with _categories_cache_lock:
+            _categories_cache[cache_key] = categories
+
+    return _with_cache_headers(jsonify({"categories": categories}), etag)
 
 
 # ──────────────────────────────────────────────────────────────
@@ -593,43 +886,24 @@ def procedures_categories():
 # ──────────────────────────────────────────────────────────────
 NPPES_URL = "https://npiregistry.cms.hhs.gov/api/"
 
-@app.route("/providers/search", methods=["GET"])
-@limiter.limit("30 per minute")
-def providers_search():
-    zip_code  = request.args.get("zip", "").strip()
-    city      = request.args.get("city", "").strip()
-    state     = request.args.get("state", "").strip().upper()
-    specialty = request.args.get("specialty", "").strip()
+# Finished /providers/search (payload, etag) pairs keyed by the NPPES query
+# params. NPI registry data changes slowly, so an hour of staleness is fine.
+_nppes_cache = TTLCache(maxsize=5000, ttl=3600)
+_nppes_cache_lock = threading.Lock()
+# Lookups currently running against NPPES, keyed like _nppes_cache. Identical
+# requests that miss the cache wait on the first one instead of repeating it.
+_nppes_inflight = {}
 
-    try:
-        limit = min(int(request.args.get("limit", 20)), 50)
-    except ValueError:
-        limit = 20
 
-    if not zip_code and not city and not state:
-        return jsonify({"error": "Provide at least a ZIP code, city, or state"}), 400
+def _nppes_cache_key(params):
+    return hashlib.sha1(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()
 
-    params = {
-        "version": "2.1",
-        "limit":   limit,
-        "enumeration_type": "NPI-1",
-    }
-    if zip_code:
-        params["postal_code"] = zip_code[:5] + "*" if len(zip_code) >= 5 else zip_code + "*"
-    if city:
-        params["city"] = city
-    if state and len(state) == 2:
-        params["state"] = state
-    if specialty:
-        params["taxonomy_description"] = specialty
 
-    try:
-        resp = http_requests.get(NPPES_URL, params=params, timeout=15)
-        resp.raise_for_status()
-        data = resp.json()
-    except Exception:
-        logger.exception("NPPES API error")
-        return jsonify({"error": "Provider search is temporarily unavailable. Please try again."}), 502
+def _nppes_search(params):
+    """Query the NPPES registry and shape the results for the frontend."""
+    resp = nppes_http.get(NPPES_URL, params=params, timeout=15)
+    resp.raise_for_status()
+    data = resp.json()
 
     raw_results = data.get("results") or []
 
@@ -673,11 +947,85 @@ def providers_search():
             },
         })
 
-    return jsonify({
+    return {
         "providers": providers,
         "count":     len(providers),
         "total":     data.get("result_count", len(providers)),
-    })
+    }
+
+
+def _nppes_lookup(params):
+    """Cached (payload, etag) for params; concurrent misses share one NPPES call."""
+    key = _nppes_cache_key(params)
+    with _nppes_cache_lock:
+        cached = _nppes_cache.get(key)
+        if cached is not None:
+            return cached
+        future = _nppes_inflight.get(key)
+        if future is None:
+            future = _nppes_inflight[key] = Future()
+            leader = True
+        else:
+            leader = False
+
+    if not leader:
+        return future.result()
+
+    try:
+        payload = _nppes_search(params)
+        cached = (payload, hashlib.sha1(orjson.dumps(payload)).hexdigest())
+        with _nppes_cache_lock:
+            _nppes_cache[key] = cached
+        future.set_result(cached)
+        return cached
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _nppes_cache_lock:
+            _nppes_inflight.pop(key, None)
+
+
+@app.route("/providers/search", methods=["GET"])
+@limiter.limit("30 per minute")
+def providers_search():
+    zip_code  = request.args.get("zip", "").strip()
+    city      = request.args.get("city", "").strip()
+    state     = request.args.get("state", "").strip().upper()
+    specialty = request.args.get("specialty", "").strip()
+
+    try:
+        limit = min(int(request.args.get("limit", 20)), 50)
+    except ValueError:
+        limit = 20
+
+    if not zip_code and not city and not state:
+        return jsonify({"error": "Provide at least a ZIP code, city, or state"}), 400
+
+    params = {
+        "version": "2.1",
+        "limit":   limit,
+        "enumeration_type": "NPI-1",
+    }
+    if zip_code:
+        params["postal_code"] = zip_code[:5] + "*" if len(zip_code) >= 5 else zip_code + "*"
+    if city:
+        params["city"] = city
+    if state and len(state) == 2:
+        params["state"] = state
+    if specialty:
+        params["taxonomy_description"] = specialty
+
+    try:
+        payload, etag = _nppes_lookup(params)
+    except Exception:
+        logger.exception("NPPES API error")
+        return jsonify({"error": "Provider search is temporarily unavailable. Please try again."}), 502
+
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    return _with_cache_headers(jsonify(payload), etag)
 
 
 # ──────────────────────────────────────────────────────────────
@@ -693,58 +1041,54 @@ def hcpcs_search():
     except ValueError:
         limit = 20
 
-    db = SessionLocal()
-    try:
-        query = db.query(HcpcsCode)
-
-        if q:
-            pattern = f"%{_escape_like(q)}%"
-            query = query.filter(
-                or_(
-                    func.lower(HcpcsCode.hcpcs_code).like(func.lower(pattern)),
-                    func.lower(HcpcsCode.short_desc).like(func.lower(pattern)),
-                    func.lower(HcpcsCode.long_desc).like(func.lower(pattern)),
-                )
-            )
+    db = db_session()
+    etag = _make_etag("hcpcs/search", q, category, limit, _data_version(db, "hcpcs"))
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
 
-        if category:
-            query = query.filter(
-                func.lower(HcpcsCode.category) == category.lower()
-            )
+    query = db.query(*_columns(HcpcsCode, HCPCS_FIELDS))
 
-        results = query.order_by(HcpcsCode.hcpcs_code).limit(limit).all()
+    if q:
+        query = query.filter(_text_search(HcpcsCode, "hcpcs_codes_fts", q))
 
-        return jsonify({
-            "results": [
-                {
-                    "hcpcs_code":  h.hcpcs_code,
-                    "short_desc":  h.short_desc,
-                    "long_desc":   h.long_desc,
-                    "category":    h.category,
-                    "source_year": h.source_year,
-                }
-                for h in results
-            ],
-            "count": len(results),
-            "query": q,
-        })
-    finally:
-        db.close()
+    if category:
+        query = query.filter(_iequals(HcpcsCode.category, category))
+
+    results = query.order_by(HcpcsCode.hcpcs_code).limit(limit).all()
+
+    return _with_cache_headers(jsonify({
+        "results": [dict(zip(HCPCS_FIELDS, row)) for row in results],
+        "count": len(results),
+        "query": q,
+    }), etag)
 
 
 @app.route("/hcpcs/categories", methods=["GET"])
 def hcpcs_categories():
-    db = SessionLocal()
-    try:
-        cats = (
+    db = db_session()
+    cache_key = ("hcpcs", _data_version(db, "hcpcs"))
+    etag = _make_etag("hcpcs/categories", *cache_key)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    with _categories_cache_lock:
+        categories = _categories_cache.get(cache_key)
+
+    if categories is None:
+        rows = (
             db.query(HcpcsCode.category)
+            .filter(HcpcsCode.category.isnot(None), HcpcsCode.category != "")
             .distinct()
             .order_by(HcpcsCode.category)
             .all()
         )
-        return jsonify({"categories": [c[0] for c in cats if c[0]]})
-    finally:
-        db.close()
+        categories = [cat for (cat,) in rows]
+        with _categories_cache_lock:
+            _categories_cache[cache_key] = categories
+
+    return _with_cache_headers(jsonify({"categories": categories}), etag)
 
 
 # ──────────────────────────────────────────────────────────────
@@ -759,37 +1103,24 @@ def icd10_search():
     except ValueError:
         limit = 20
 
-    db = SessionLocal()
-    try:
-        query = db.query(Icd10Procedure)
-
-        if q:
-            pattern = f"%{_escape_like(q)}%"
-            query = query.filter(
-                or_(
-                    func.lower(Icd10Procedure.icd10_code).like(func.lower(pattern)),
-                    func.lower(Icd10Procedure.short_desc).like(func.lower(pattern)),
-                    func.lower(Icd10Procedure.long_desc).like(func.lower(pattern)),
-                )
-            )
+    db = db_session()
+    etag = _make_etag("icd10/search", q, limit, _data_version(db, "icd10"))
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
 
-        results = query.order_by(Icd10Procedure.icd10_code).limit(limit).all()
+    query = db.query(*_columns(Icd10Procedure, ICD10_FIELDS))
 
-        return jsonify({
-            "results": [
-                {
-                    "icd10_code": i.icd10_code,
-                    "short_desc": i.short_desc,
-                    "long_desc":  i.long_desc,
-                    "source_year": i.source_year,
-                }
-                for i in results
-            ],
-            "count": len(results),
-            "query": q,
-        })
-    finally:
-        db.close()
+    if q:
+        query = query.filter(_text_search(Icd10Procedure, "icd10_procedures_fts", q))
+
+    results = query.order_by(Icd10Procedure.icd10_code).limit(limit).all()
+
+    return _with_cache_headers(jsonify({
+        "results": [dict(zip(ICD10_FIELDS, row)) for row in results],
+        "count": len(results),
+        "query": q,
+    }), etag)
 
 
 # ──────────────────────────────────────────────────────────────
@@ -797,29 +1128,44 @@ def icd10_search():
 # ──────────────────────────────────────────────────────────────
 @app.route("/pipeline/status", methods=["GET"])
 def pipeline_status():
-    db = SessionLocal()
-    try:
-        sources = {}
-        for source_name in ("pfs", "hcpcs", "icd10", "utilization"):
-            last = (
-                db.query(DataSyncLog)
-                .filter_by(source_name=source_name)
-                .order_by(DataSyncLog.started_at.desc())
-                .first()
-            )
-            if last:
-                sources[source_name] = {
-                    "status": last.status,
-                    "started_at": last.started_at.isoformat() if last.started_at else None,
-                    "completed_at": last.completed_at.isoformat() if last.completed_at else None,
-                    "records_processed": last.records_processed,
-                    "records_inserted": last.records_inserted,
-                    "records_updated": last.records_updated,
-                    "error_message": last.error_message,
-                }
-            else:
-                sources[source_name] = {"status": "never_run"}
-
-        return jsonify({"sources": sources})
-    finally:
-        db.close()
+    db = db_session()
+    source_names = ("pfs", "hcpcs", "icd10", "utilization")
+
+    # Latest log row per source in one query: rank each source's rows by
+    # started_at and keep the first.
+    ranked = (
+        db.query(
+            DataSyncLog.id,
+            func.row_number().over(
+                partition_by=DataSyncLog.source_name,
+                order_by=DataSyncLog.started_at.desc(),
+            ).label("rn"),
+        )
+        .filter(DataSyncLog.source_name.in_(source_names))
+        .subquery()
+    )
+    rows = (
+        db.query(DataSyncLog)
+        .join(ranked, DataSyncLog.id == ranked.c.id)
+        .filter(ranked.c.rn == 1)
+        .all()
+    )
+    last_by_source = {row.source_name: row for row in rows}
+
+    sources = {}
+    for source_name in source_names:
+        last = last_by_source.get(source_name)
+        if last:
+            sources[source_name] = {
+                "status": last.status,
+                "started_at": last.started_at.isoformat() if last.started_at else None,
+                "completed_at": last.completed_at.isoformat() if last.completed_at else None,
+                "records_processed": last.records_processed,
+                "records_inserted": last.records_inserted,
+                "records_updated": last.records_updated,
+                "error_message": last.error_message,
+            }
+        else:
+            sources[source_name] = {"status": "never_run"}
+
+    return jsonify({"sources": sources})
@@ -1,8 +1,86 @@
-
-from sqlalchemy import create_engine
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app.db")
+# Log every SQL statement; useful when debugging, far too noisy (and slow) otherwise.
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "false").lower() == "true"
+# Connections the app may hold across all gunicorn workers. Stock Postgres
+# allows 100 and Supabase fewer, so each worker gets an equal share of this
+# budget, never more than one per request thread (a thread holds at most one).
+DATABASE_MAX_CONNECTIONS = int(os.getenv("DATABASE_MAX_CONNECTIONS", "60"))
+_workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+_threads = int(os.getenv("GUNICORN_THREADS", "16"))
+DATABASE_POOL_SIZE = int(os.getenv(
+    "DATABASE_POOL_SIZE", max(1, min(_threads, DATABASE_MAX_CONNECTIONS // _workers))
+))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "0"))
+
+# Sizing only applies to a QueuePool (file databases and servers); in-memory
+# SQLite gets a SingletonThreadPool, which rejects these arguments.
+# LIFO checkout keeps reusing the most recently returned (warm) connection
+# so surplus idle connections can age out instead of being rotated through.
+_url = make_url(DATABASE_URL)
+_pool_options = {}
+if issubclass(_url.get_dialect().get_pool_class(_url), QueuePool):
+    _pool_options = dict(
+        pool_use_lifo=True,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+    )
+
+engine = create_engine(
+    DATABASE_URL,
+    echo=DATABASE_ECHO,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    **_pool_options,
+)
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run alongside the pipeline's writes; the rest trade
+        # a little durability on power loss for far fewer fsyncs and more cache.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
 
-engine = create_engine("sqlite:///app.db", echo=True)
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine)
+
+# Session for the CMS data pipeline. Stages write through explicit bulk upserts
+# and commits, so autoflush would only add flushes, and their sync-log rows stay
+# usable after each commit without a reload.
+PipelineSession = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+if engine.dialect.name == "postgresql":
+    @event.listens_for(PipelineSession, "after_begin")
+    def _pipeline_async_commit(session, transaction, connection):
+        # Don't wait for the WAL fsync on each pipeline commit. A crash can lose
+        # the last few commits, which the next sync simply redoes. SET LOCAL
+        # ends with the transaction, so pooled connections are left untouched.
+        connection.exec_driver_sql("SET LOCAL synchronous_commit = off")
+
+# Request-scoped session for the Flask app, released in teardown_appcontext.
+# Request handlers only read, so loaded rows never need re-fetching after a commit.
+db_session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+
+
+def init_db():
+    """Create any missing tables. Run once before starting workers."""
+    import models  # noqa: F401 — registers every model on Base.metadata
+    Base.metadata.create_all(bind=engine)
+
+
+if __name__ == "__main__":
+    init_db()
@@ -0,0 +1,26 @@
+"""
+Gunicorn settings for production serving.
+
+  cd backend && gunicorn app:app
+
+Threaded workers keep a slow OpenAI, Supabase or NPPES call from pinning a
+whole process. Run with RATELIMIT_STORAGE_URI pointing at Redis so rate
+limits are shared across workers.
+
+Set the worker and thread counts through GUNICORN_WORKERS/GUNICORN_THREADS
+rather than -w/--threads: they are exported to the workers, which split the
+database connection budget and the OCR threads between them.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+# One process per core: each is multi-threaded, so the 2n+1 rule for sync
+# workers would only multiply the per-process DB and OCR pools.
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+os.environ["GUNICORN_WORKERS"] = str(workers)
+os.environ["GUNICORN_THREADS"] = str(threads)
+timeout = 120  # a full bill analysis can take well over the 30s default
+keepalive = 30
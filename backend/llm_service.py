@@ -3,42 +3,66 @@ LLM service for analyzing medical bills using OpenAI API.
 Handles data extraction, cost analysis, and summary generation.
 """
 import os
-import json
+import orjson
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 from openai import OpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger("medicheck.llm")
 
-class LLMAnalyzer:
-    """Analyze medical bills using OpenAI GPT."""
+# Bump whenever a prompt changes so cached results from the old prompt are ignored.
+PROMPT_VERSION = "v7"
 
-    def __init__(self):
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        self.client = OpenAI(api_key=api_key)
-        self.model = "gpt-4o-mini"
+# Completed analyses, keyed by model + prompt version + whitespace-normalized
+# bill text, so the same bill extracted or OCR'd with different spacing hits.
+# Cached results include patient names, addresses and charges, so the cache is
+# opt-in: it stays off unless LLM_CACHE_TTL (seconds) is set above 0, and even
+# then lives in process memory only.
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "0"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
 
-    def _call(self, system: str, prompt: str, temperature: float = 0.3) -> dict:
-        response = self.client.chat.completions.create(
-            model=self.model,
-            temperature=temperature,
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": prompt},
-            ],
-        )
-        return json.loads(response.choices[0].message.content)
+# Upper bound on OpenAI calls one bill has in flight at once (page-chunk extraction).
+LLM_CALL_CONCURRENCY = int(os.getenv("LLM_CALL_CONCURRENCY", "8"))
 
-    def classify_document(self, raw_text):
-        """Determine if the document is a healthcare-related bill."""
-        return self._call(
-            system="You are a document classification expert. Always respond with valid JSON only.",
-            prompt=f"""Analyze this document text and determine if it is a healthcare-related bill, invoice, or statement.
+# How much bill text goes into a prompt, in tokens. gpt-4o-mini averages about
+# four characters of English per token, which is close enough for budgeting.
+# Longer bills are split on page breaks and extracted chunk by chunk.
+CHARS_PER_TOKEN = 4
+LLM_TEXT_TOKEN_BUDGET = int(os.getenv("LLM_TEXT_TOKEN_BUDGET", "4000"))
+CLASSIFY_TOKEN_BUDGET = 750
+
+# The parts of the extracted bill the audit needs. Patient name and address
+# only matter for the summary's dispute email, so they are not re-sent.
+AUDIT_FIELDS = ("provider_name", "date_of_service", "charges", "total", "insurance_info", "patient_responsibility")
+
+# TextExtractor separates PDF pages with a form feed.
+PAGE_BREAK = "\f"
+
+# Extra attempts for a step whose reply is not the JSON shape we asked for.
+# The model is shown its own reply and the problem, which usually fixes it.
+LLM_VALIDATION_RETRIES = int(os.getenv("LLM_VALIDATION_RETRIES", "2"))
 
-{raw_text[:3000]}
+_result_cache = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL) if LLM_CACHE_TTL > 0 else None
+_result_cache_lock = threading.Lock()
+# Individual LLM replies keyed by the exact request (model, stage, prompts),
+# so a bill that misses the whole-result cache still reuses any stage whose
+# input is unchanged, e.g. extraction after only the summary prompt changed.
+_stage_cache = TTLCache(maxsize=LLM_CACHE_SIZE * 4, ttl=LLM_CACHE_TTL) if LLM_CACHE_TTL > 0 else None
+
+
+# System prompts carry every fixed instruction; the user message is only the
+# bill itself. Keeping the static text first and byte-identical across
+# requests lets OpenAI reuse its cached prompt prefix. The reply format is not
+# described here: each request sends a strict JSON schema (below) instead.
+_CLASSIFY_SYSTEM = """You are a document classification expert.
+
+Analyze the document text you are given and determine if it is a healthcare-related bill, invoice, or statement.
 
 ALL of these should return is_healthcare_bill = true:
 - Medical bills, hospital bills, clinic bills
@@ -50,46 +74,15 @@ ALL of these should return is_healthcare_bill = true:
 - Vision/optometry bills
 - Any bill from a healthcare provider
 
-Only return is_healthcare_bill = false for documents that are clearly NOT healthcare-related (e.g., utility bills, restaurant receipts, retail invoices, tax documents, etc.)
+Only return is_healthcare_bill = false for documents that are clearly NOT healthcare-related (e.g., utility bills, restaurant receipts, retail invoices, tax documents, etc.)"""
 
-Return JSON:
-{{
-  "is_healthcare_bill": true/false,
-  "document_type": "medical bill" | "dental bill" | "pharmacy bill" | "insurance EOB" | "lab bill" | "vision bill" | "general invoice" | "receipt" | "other",
-  "confidence": 0.0-1.0,
-  "reason": "brief explanation of why this is or is not a healthcare bill"
-}}""",
-            temperature=0.1,
-        )
+_EXTRACT_SYSTEM = """You are a medical billing data extraction expert.
 
-    def extract_structured_data(self, raw_text):
-        return self._call(
-            system="You are a medical billing data extraction expert. Always respond with valid JSON only.",
-            prompt=f"""Extract from medical bill:
-
-{raw_text[:4000]}
-
-Return JSON:
-{{
-  "patient_name": "name or 'Not found'",
-  "date_of_service": "YYYY-MM-DD or 'Not found'",
-  "provider_name": "clinic name or 'Not found'",
-  "provider_address": "address or 'Not found'",
-  "charges": [{{"item": "service", "cost": number, "code": "code"}}],
-  "total": number,
-  "insurance_info": "insurance or 'Not found'",
-  "patient_responsibility": number
-}}""",
-            temperature=0.1,
-        )
+Extract the patient, provider, every charge and the totals from the medical bill you are given. Use 'Not found' for any text field the bill does not show and 0 for any missing amount."""
 
-    def analyze_costs(self, structured_data):
-        return self._call(
-            system="You are a medical billing audit expert with deep knowledge of Medicare rates, CDT dental codes, CPT codes, and typical US healthcare pricing. Always respond with valid JSON only.",
-            prompt=f"""Perform a thorough audit of this medical/dental bill. For EVERY charge, provide a detailed assessment.
+_AUDIT_SYSTEM = """You are a medical billing audit expert with deep knowledge of Medicare rates, CDT dental codes, CPT codes, and typical US healthcare pricing.
 
-Bill data:
-{json.dumps(structured_data)}
+Perform a thorough audit of the medical/dental bill data you are given. For EVERY charge, provide a detailed assessment.
 
 For each charge, evaluate:
 1. Is the price reasonable compared to typical US rates for this service?
@@ -101,62 +94,465 @@ For each charge, evaluate:
 
 Even if charges appear reasonable, explain WHY they are reasonable (e.g., "The $250 charge for a dental cleaning is within the typical $100-$300 range for a comprehensive cleaning").
 
-Return JSON:
-{{
-  "charge_assessments": [
-    {{
-      "item": "the service name",
-      "charged_amount": number,
-      "typical_range_low": number,
-      "typical_range_high": number,
-      "assessment": "detailed explanation of whether this charge is fair and why",
-      "status": "fair" | "high" | "overcharged" | "low" | "unclear"
-    }}
-  ],
-  "issues": [{{"type": "type", "description": "desc", "item": "item", "severity": "low/medium/high"}}],
-  "overall_severity": "low/medium/high",
-  "potential_savings": number,
-  "recommendations": ["actionable recommendation 1", "actionable recommendation 2"]
-}}
-
-IMPORTANT: charge_assessments must have one entry per charge. If there are no issues, still provide helpful recommendations (e.g., "Request an itemized bill", "Verify insurance was applied correctly", "Compare with other providers in your area").""",
-            temperature=0.3,
-        )
+IMPORTANT: charge_assessments must have one entry per charge. If there are no issues, still provide helpful recommendations (e.g., "Request an itemized bill", "Verify insurance was applied correctly", "Compare with other providers in your area")."""
 
-    def generate_summary(self, structured_data, analysis_results):
-        return self._call(
-            system="You are a helpful patient advocate who explains medical bills in plain language. Always respond with valid JSON only.",
-            prompt=f"""Summarize this bill analysis for a patient. Reference specific charges and their assessments.
+_SUMMARY_SYSTEM = """You are a helpful patient advocate who explains medical bills in plain language.
 
-Bill: {json.dumps(structured_data)}
-Analysis: {json.dumps(analysis_results)}
+Summarize the bill analysis you are given for a patient. Reference specific charges and their assessments.
 
 Write a summary that:
 1. Explains what services were billed and the total
 2. For EACH charge, mention whether it's fairly priced and the typical range
 3. Highlights any issues or concerns found
 4. Gives specific next steps the patient should take
-5. If issues were found, draft a professional dispute email
+5. If issues were found, draft a professional dispute email"""
+
+_FUSED_SYSTEM = """You are a medical billing expert and patient advocate: you classify documents, extract billing data, audit charges against Medicare, CDT, CPT and typical US healthcare pricing, and explain the results in plain language.
+
+Work through the document you are given in four steps and return every result in ONE JSON object.
+
+Step 1 — classification. Is this a healthcare-related bill, invoice, statement or insurance EOB (medical, hospital, dental, pharmacy, lab, mental health, vision, or any healthcare provider)? Only documents clearly NOT healthcare-related (utility bills, restaurant receipts, retail invoices, tax documents, etc.) are false. If false, stop here: leave every remaining string empty, every number 0 and every list empty.
+
+Step 2 — structured_data. Extract patient, provider, every charge and totals. Use 'Not found' for any text field the bill does not show and 0 for any missing amount.
+
+Step 3 — analysis_results. Audit EVERY charge: is the price reasonable for typical US rates, is the code appropriate, any upcoding, unbundling or duplicates, are insurance adjustments reasonable? For dental compare against typical dental fee ranges (cleaning $100-$300, filling $150-$400, crown $800-$1500, root canal $700-$1200, extraction $150-$600); for medical against Medicare and typical private-pay rates. Explain WHY each charge is or is not reasonable. charge_assessments must have one entry per charge; always give actionable recommendations (e.g. "Request an itemized bill").
+
+Step 4 — summary and complaint_email. A 3-4 paragraph friendly summary for the patient that explains the services and total, says for EACH charge whether it is fairly priced and the typical range, highlights concerns and gives next steps. If issues were found, draft a professional dispute email; otherwise use an empty string."""
+
+
+def _strict_object(properties):
+    """JSON schema object for strict structured outputs: every key required, no extras."""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def _string(description=None, enum=None):
+    schema = {"type": "string"}
+    if description:
+        schema["description"] = description
+    if enum:
+        schema["enum"] = enum
+    return schema
+
+
+def _response_format(name, properties):
+    """Strict structured output: the API guarantees a reply of exactly this shape."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": _strict_object(properties)},
+    }
+
+
+_NUMBER = {"type": "number"}
+_SEVERITY = _string(enum=["low", "medium", "high"])
+
+CLASSIFICATION_FIELDS = {
+    "is_healthcare_bill": {"type": "boolean"},
+    "document_type": _string(enum=[
+        "medical bill", "dental bill", "pharmacy bill", "insurance EOB", "lab bill",
+        "vision bill", "general invoice", "receipt", "other",
+    ]),
+    "confidence": {"type": "number", "description": "0.0-1.0"},
+    "reason": _string("brief explanation of why this is or is not a healthcare bill"),
+}
+
+STRUCTURED_DATA_FIELDS = {
+    "patient_name": _string("name or 'Not found'"),
+    "date_of_service": _string("YYYY-MM-DD or 'Not found'"),
+    "provider_name": _string("clinic name or 'Not found'"),
+    "provider_address": _string("address or 'Not found'"),
+    "charges": {"type": "array", "items": _strict_object({
+        "item": _string("service"),
+        "cost": _NUMBER,
+        "code": _string("billing code"),
+    })},
+    "total": _NUMBER,
+    "insurance_info": _string("insurance or 'Not found'"),
+    "patient_responsibility": _NUMBER,
+}
+
+ANALYSIS_FIELDS = {
+    "charge_assessments": {"type": "array", "items": _strict_object({
+        "item": _string("the service name"),
+        "charged_amount": _NUMBER,
+        "typical_range_low": _NUMBER,
+        "typical_range_high": _NUMBER,
+        "assessment": _string("detailed explanation of whether this charge is fair and why"),
+        "status": _string(enum=["fair", "high", "overcharged", "low", "unclear"]),
+    })},
+    "issues": {"type": "array", "items": _strict_object({
+        "type": _string(),
+        "description": _string(),
+        "item": _string(),
+        "severity": _SEVERITY,
+    })},
+    "overall_severity": _SEVERITY,
+    "potential_savings": _NUMBER,
+    "recommendations": {"type": "array", "items": _string("actionable recommendation")},
+}
+
+SUMMARY_FIELDS = {
+    "summary": _string("3-4 paragraph detailed friendly summary with per-charge insights"),
+    "complaint_email": _string("professional email or empty string if no issues"),
+}
+
+CLASSIFY_RESPONSE_FORMAT = _response_format("document_classification", CLASSIFICATION_FIELDS)
+EXTRACT_RESPONSE_FORMAT = _response_format("bill_extract", STRUCTURED_DATA_FIELDS)
+AUDIT_RESPONSE_FORMAT = _response_format("cost_analysis", ANALYSIS_FIELDS)
+SUMMARY_RESPONSE_FORMAT = _response_format("bill_summary", SUMMARY_FIELDS)
+FUSED_RESPONSE_FORMAT = _response_format("bill_analysis", {
+    "classification": _strict_object(CLASSIFICATION_FIELDS),
+    "structured_data": _strict_object(STRUCTURED_DATA_FIELDS),
+    "analysis_results": _strict_object(ANALYSIS_FIELDS),
+    **SUMMARY_FIELDS,
+})
+
+
+def text_digest(raw_text, *parts):
+    """SHA-256 hex digest of raw_text, namespaced by any extra key parts."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"|")
+    h.update(raw_text.encode("utf-8"))
+    return h.hexdigest()
+
+
+def cache_key(raw_text, *parts):
+    """text_digest() of raw_text with runs of whitespace collapsed."""
+    return text_digest(" ".join(raw_text.split()), *parts)
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, budget):
+    return text[:budget * CHARS_PER_TOKEN]
+
+
+def split_pages(raw_text, budget=LLM_TEXT_TOKEN_BUDGET):
+    """Group whole pages into chunks of at most budget tokens each."""
+    chunks, pages, size = [], [], 0
+    for page in raw_text.split(PAGE_BREAK):
+        # A single page over budget is cut down rather than split mid-page.
+        page = truncate_to_tokens(page, budget)
+        tokens = estimate_tokens(page)
+        if pages and size + tokens > budget:
+            chunks.append(PAGE_BREAK.join(pages))
+            pages, size = [], 0
+        pages.append(page)
+        size += tokens
+    chunks.append(PAGE_BREAK.join(pages))
+    return chunks
+
+
+def _compact_json(data):
+    """JSON without padding whitespace or \\u escapes, to keep prompts short."""
+    return orjson.dumps(data).decode()
+
+
+def _missing(value):
+    return value in (None, "", 0, "Not found")
+
+
+def merge_structured_data(parts):
+    """Combine per-chunk extractions: concatenate charges, keep the first real value of each field."""
+    merged = {"charges": []}
+    for part in parts:
+        for key, value in part.items():
+            if key == "charges":
+                if isinstance(value, list):
+                    merged["charges"].extend(value)
+            elif _missing(merged.get(key)):
+                merged[key] = value
+    return merged
+
 
-Return JSON:
-{{
-  "summary": "3-4 paragraph detailed friendly summary with per-charge insights",
-  "complaint_email": "professional email or empty string if no issues"
-}}""",
+# Shape checks for the step-by-step replies: each returns a description of the
+# problem, or None if the reply has everything the pipeline reads.
+def _check_classification(data):
+    if not isinstance(data.get("is_healthcare_bill"), bool):
+        return '"is_healthcare_bill" must be true or false'
+    return None
+
+
+def _check_structured_data(data):
+    if not isinstance(data.get("charges"), list):
+        return '"charges" must be a list'
+    return None
+
+
+def _check_analysis(data):
+    for key in ("charge_assessments", "issues"):
+        if not isinstance(data.get(key), list):
+            return f'"{key}" must be a list'
+    return None
+
+
+def _check_summary(data):
+    if not isinstance(data.get("summary"), str) or not data["summary"]:
+        return '"summary" must be a non-empty string'
+    if not isinstance(data.get("complaint_email"), str):
+        return '"complaint_email" must be a string'
+    return None
+
+
+def _reply_error(content, validate):
+    """(parsed reply, None) if content is valid, else (None, problem description)."""
+    try:
+        data = orjson.loads(content)
+    except orjson.JSONDecodeError as e:
+        return None, f"it is not valid JSON ({e})"
+    if not isinstance(data, dict):
+        return None, "it is not a JSON object"
+    error = validate(data)
+    return (None, error) if error else (data, None)
+
+
+def _retry_messages(messages, content, error):
+    return messages + [
+        {"role": "assistant", "content": content or ""},
+        {"role": "user", "content": f"Your previous reply was rejected because {error}. Return the corrected JSON only."},
+    ]
+
+
+class LLMAnalyzer:
+    """Analyze medical bills using OpenAI GPT."""
+
+    def __init__(self):
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables")
+        self.client = OpenAI(api_key=api_key)
+        self.model = "gpt-4o-mini"
+        # Classification is a yes/no call, so it runs on a smaller, cheaper model.
+        self.classify_model = os.getenv("CLASSIFY_MODEL", "gpt-4.1-nano")
+
+    def _request(self, stage: str, system: str, prompt: str, response_format: dict,
+                 temperature: float = 0.3, model: str = None) -> dict:
+        return {
+            "model": model or self.model,
+            "temperature": temperature,
+            "response_format": response_format,
+            # Routes requests for the same stage to the same cache so the
+            # system prefix keeps hitting; changes whenever the prompts do.
+            "prompt_cache_key": f"medicheck-{stage}-{PROMPT_VERSION}",
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+        }
+
+    @staticmethod
+    def _log_usage(request, response):
+        """Debug-log token usage, including how much of the prompt was served from cache."""
+        usage = getattr(response, "usage", None)
+        if usage is None or not logger.isEnabledFor(logging.DEBUG):
+            return
+        details = usage.prompt_tokens_details
+        logger.debug(
+            "%s: %d prompt tokens (%d cached), %d completion tokens",
+            request["prompt_cache_key"],
+            usage.prompt_tokens,
+            (details.cached_tokens or 0) if details else 0,
+            usage.completion_tokens,
+        )
+
+    @staticmethod
+    def _stage_lookup(request):
+        """(cache key, cached reply or None) for a request; (None, None) with caching off."""
+        if _stage_cache is None:
+            return None, None
+        key = hashlib.sha256(orjson.dumps(request, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        with _result_cache_lock:
+            return key, _stage_cache.get(key)
+
+    @staticmethod
+    def _stage_store(key, result):
+        if key is not None:
+            with _result_cache_lock:
+                _stage_cache[key] = result
+
+    def _call(self, request: dict, validate=None) -> dict:
+        """
+        Send a request and parse its JSON reply.
+        
+        With validate, a malformed reply is sent back to the model with the
+        problem described, up to LLM_VALIDATION_RETRIES times, before giving up
+        with ValueError. Without it, JSON errors propagate immediately.
+        """
+        key, cached = self._stage_lookup(request)
+        if cached is not None:
+            return cached
+        messages = request["messages"]
+        for _ in range(LLM_VALIDATION_RETRIES + 1):
+            response = self.client.chat.completions.create(**{**request, "messages": messages})
+            self._log_usage(request, response)
+            content = response.choices[0].message.content
+            if validate is None:
+                result = orjson.loads(content)
+                break
+            result, error = _reply_error(content, validate)
+            if result is not None:
+                break
+            messages = _retry_messages(messages, content, error)
+        else:
+            raise ValueError(f"{request['prompt_cache_key']}: invalid reply after retries: {error}")
+        self._stage_store(key, result)
+        return result
+
+    def _classify_document_request(self, raw_text):
+        return self._request(
+            "classify",
+            _CLASSIFY_SYSTEM,
+            f"Document text:\n\n{truncate_to_tokens(raw_text, CLASSIFY_TOKEN_BUDGET)}",
+            temperature=0.1,
+            response_format=CLASSIFY_RESPONSE_FORMAT,
+            model=self.classify_model,
+        )
+
+    def _extract_structured_data_request(self, raw_text):
+        return self._request(
+            "extract",
+            _EXTRACT_SYSTEM,
+            f"Medical bill:\n\n{raw_text}",
+            temperature=0.1,
+            response_format=EXTRACT_RESPONSE_FORMAT,
+        )
+
+    def _analyze_costs_request(self, structured_data):
+        bill = {k: structured_data[k] for k in AUDIT_FIELDS if k in structured_data}
+        return self._request(
+            "audit",
+            _AUDIT_SYSTEM,
+            f"Bill data:\n{_compact_json(bill)}",
+            temperature=0.3,
+            response_format=AUDIT_RESPONSE_FORMAT,
+        )
+
+    def _generate_summary_request(self, structured_data, analysis_results):
+        return self._request(
+            "summary",
+            _SUMMARY_SYSTEM,
+            f"Bill: {_compact_json(structured_data)}\nAnalysis: {_compact_json(analysis_results)}",
             temperature=0.7,
+            response_format=SUMMARY_RESPONSE_FORMAT,
         )
 
-    def analyze_bill(self, raw_text):
-        # Step 0: Classify the document
-        classification = self.classify_document(raw_text)
-        if not classification.get("is_healthcare_bill", False):
+    def _fused_analysis_request(self, raw_text):
+        """One prompt covering classification, extraction, audit and summary."""
+        return self._request(
+            "fused",
+            _FUSED_SYSTEM,
+            f"Document text:\n\n{raw_text}",
+            temperature=0.3,
+            response_format=FUSED_RESPONSE_FORMAT,
+        )
+
+    @staticmethod
+    def _fused_result(response):
+        """Shape a fused response like analyze_bill's result, or None if malformed."""
+        classification = response.get("classification")
+        if not isinstance(classification, dict) or "is_healthcare_bill" not in classification:
+            return None
+        if not classification["is_healthcare_bill"]:
             return {
                 "rejected": True,
                 "document_type": classification.get("document_type", "unknown"),
                 "reason": classification.get("reason", "This does not appear to be a medical bill."),
             }
+        structured_data = response.get("structured_data")
+        analysis_results = response.get("analysis_results")
+        summary = response.get("summary")
+        if not (
+            isinstance(structured_data, dict) and isinstance(structured_data.get("charges"), list)
+            and isinstance(analysis_results, dict) and isinstance(analysis_results.get("issues"), list)
+            and isinstance(summary, str) and summary
+            and isinstance(response.get("complaint_email", ""), str)
+        ):
+            return None
+        return {
+            "structured_data": structured_data,
+            "analysis_results": analysis_results,
+            "summary": summary,
+            "complaint_email": response.get("complaint_email", ""),
+        }
+
+    def classify_document(self, raw_text):
+        """Determine if the document is a healthcare-related bill."""
+        return self._call(self._classify_document_request(raw_text), _check_classification)
+
+    def extract_structured_data(self, raw_text):
+        chunks = split_pages(raw_text)
+        if len(chunks) == 1:
+            return self._call(self._extract_structured_data_request(chunks[0]), _check_structured_data)
+        with ThreadPoolExecutor(max_workers=min(len(chunks), LLM_CALL_CONCURRENCY)) as pool:
+            parts = pool.map(
+                lambda chunk: self._call(self._extract_structured_data_request(chunk), _check_structured_data),
+                chunks,
+            )
+            return merge_structured_data(parts)
+
+    def analyze_costs(self, structured_data):
+        return self._call(self._analyze_costs_request(structured_data), _check_analysis)
+
+    def generate_summary(self, structured_data, analysis_results):
+        return self._call(self._generate_summary_request(structured_data, analysis_results), _check_summary)
+
+    def analyze_bill(self, raw_text):
+        """Run the full pipeline, returning a cached result for identical text."""
+        if _result_cache is None:
+            return self._analyze_bill_uncached(raw_text)
+
+        key = cache_key(raw_text, self.model, self.classify_model, PROMPT_VERSION)
+        with _result_cache_lock:
+            cached = _result_cache.get(key)
+        if cached is not None:
+            return cached
+
+        result = self._analyze_bill_uncached(raw_text)
+        with _result_cache_lock:
+            _result_cache[key] = result
+        return result
+
+    def _analyze_bill_uncached(self, raw_text):
+        # One round-trip for the whole analysis; fall back to the step-by-step
+        # calls if the fused answer is not valid or the bill is too long for
+        # one prompt.
+        if estimate_tokens(raw_text) > LLM_TEXT_TOKEN_BUDGET:
+            return self._analyze_bill_steps(raw_text)
+        try:
+            result = self._fused_result(self._call(self._fused_analysis_request(raw_text)))
+        except orjson.JSONDecodeError:
+            result = None
+        if result is not None:
+            return result
+        return self._analyze_bill_steps(raw_text)
+
+    def _analyze_bill_steps(self, raw_text):
+        # Classification and extraction both need only the raw text, so the
+        # extraction starts on a worker thread while the document is
+        # classified; a rejected document returns without waiting for it.
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            extraction = pool.submit(self.extract_structured_data, raw_text)
+            classification = self.classify_document(raw_text)
+            if not classification.get("is_healthcare_bill", False):
+                extraction.cancel()
+                return {
+                    "rejected": True,
+                    "document_type": classification.get("document_type", "unknown"),
+                    "reason": classification.get("reason", "This does not appear to be a medical bill."),
+                }
+            structured_data = extraction.result()
+        finally:
+            pool.shutdown(wait=False)
 
-        structured_data = self.extract_structured_data(raw_text)
         analysis_results = self.analyze_costs(structured_data)
         summary_data = self.generate_summary(structured_data, analysis_results)
 
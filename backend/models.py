@@ -1,9 +1,90 @@
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, Index, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, Index, UniqueConstraint, DDL, JSON, event
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import deferred
 from datetime import datetime
 from database import Base
 
 
+# The search endpoints filter with ILIKE '%q%'. On PostgreSQL a pg_trgm GIN
+# index serves those substring matches; other dialects skip these indexes.
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
+def _trgm_index(name, column):
+    return Index(
+        name, column,
+        postgresql_using="gin",
+        postgresql_ops={column: "gin_trgm_ops"},
+    ).ddl_if(dialect="postgresql")
+
+
+def _nocase_string(length):
+    """String column that SQLite compares case-insensitively (COLLATE NOCASE),
+    so equality filters can use the B-tree index without lower()."""
+    return String(length).with_variant(String(length, collation="NOCASE"), "sqlite")
+
+
+# SQLite has no trigram index type, so the same searches go through FTS5
+# tables using the trigram tokenizer (substring, case-insensitive matching,
+# i.e. the same results as LIKE '%q%'). They mirror the searchable columns
+# and are kept in sync by triggers.
+SEARCH_FTS_TABLES = {
+    "procedures_fts": ("procedures", ("cpt_code", "description", "category")),
+    "hcpcs_codes_fts": ("hcpcs_codes", ("hcpcs_code", "short_desc", "long_desc")),
+    "icd10_procedures_fts": ("icd10_procedures", ("icd10_code", "short_desc", "long_desc")),
+}
+
+
+def create_search_fts(connection):
+    """Create and backfill any missing SQLite FTS5 search tables."""
+    if connection.dialect.name != "sqlite":
+        return
+    for fts, (table, columns) in SEARCH_FTS_TABLES.items():
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ).first()
+        if exists:
+            continue
+        cols = ", ".join(columns)
+        new = ", ".join(f"new.{c}" for c in columns)
+        old = ", ".join(f"old.{c}" for c in columns)
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, "
+            f"content='{table}', content_rowid='id', tokenize='trigram')"
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END"
+        )
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+event.listen(
+    Base.metadata,
+    "after_create",
+    lambda target, connection, **kw: create_search_fts(connection),
+)
+
+
+# Native JSON column: SQLAlchemy hands back parsed dicts, and PostgreSQL
+# stores it as binary JSONB.
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
+
 class Item(Base):
     __tablename__ = "items"
     id = Column(Integer, primary_key=True, index=True)
@@ -17,10 +98,11 @@ class Bill(Base):
     filename = Column(String, nullable=False)
     upload_date = Column(DateTime, default=datetime.utcnow)
     file_type = Column(String)
-    raw_text = Column(Text)
-    structured_data = Column(Text)
-    analysis_results = Column(Text)
-    summary = Column(Text)
+    # Large LLM inputs/outputs load only when accessed, not with every row.
+    raw_text = deferred(Column(Text))
+    structured_data = deferred(Column(JSONType))
+    analysis_results = deferred(Column(JSONType))
+    summary = deferred(Column(Text))
     status = Column(String, default="uploaded")
     total_amount = Column(Float)
 
@@ -29,10 +111,11 @@ class Procedure(Base):
     __tablename__ = "procedures"
 
     id = Column(Integer, primary_key=True, index=True)
-    cpt_code = Column(String(10), nullable=False, index=True)
+    # Looked up through uq_procedure_code_mod, whose leading column it is.
+    cpt_code = Column(_nocase_string(10), nullable=False)
     modifier = Column(String(5), default="")
     description = Column(String(500), nullable=False)
-    category = Column(String(100), nullable=False, index=True)
+    category = Column(_nocase_string(100), nullable=False, index=True)
 
     # Pricing (backward-compatible fields)
     medicare_rate = Column(Float)       # = non_fac_fee
@@ -59,6 +142,13 @@ class Procedure(Base):
 
     __table_args__ = (
         UniqueConstraint("cpt_code", "modifier", name="uq_procedure_code_mod"),
+        # /procedures/search filters on modifier (+ category) and orders by
+        # rate-is-null, category, cpt_code.
+        Index("ix_proc_mod_cat_code", "modifier", "category", "cpt_code"),
+        Index("ix_proc_mod_rate_null", "modifier", "medicare_rate"),
+        _trgm_index("ix_proc_cpt_code_trgm", "cpt_code"),
+        _trgm_index("ix_proc_description_trgm", "description"),
+        _trgm_index("ix_proc_category_trgm", "category"),
     )
 
 
@@ -66,34 +156,47 @@ class HcpcsCode(Base):
     __tablename__ = "hcpcs_codes"
 
     id = Column(Integer, primary_key=True, index=True)
-    hcpcs_code = Column(String(10), unique=True, nullable=False, index=True)
+    hcpcs_code = Column(_nocase_string(10), unique=True, nullable=False, index=True)
     short_desc = Column(String(300))
     long_desc = Column(Text)
     add_date = Column(String(20))
     term_date = Column(String(20))
-    category = Column(String(100), index=True)
+    category = Column(_nocase_string(100), index=True)
     source = Column(String(50), default="nlm_hcpcs")
     source_year = Column(Integer)
 
+    __table_args__ = (
+        Index("ix_hcpcs_cat_code", "category", "hcpcs_code"),
+        _trgm_index("ix_hcpcs_code_trgm", "hcpcs_code"),
+        _trgm_index("ix_hcpcs_short_desc_trgm", "short_desc"),
+        _trgm_index("ix_hcpcs_long_desc_trgm", "long_desc"),
+    )
+
 
 class Icd10Procedure(Base):
     __tablename__ = "icd10_procedures"
 
     id = Column(Integer, primary_key=True, index=True)
-    icd10_code = Column(String(10), unique=True, nullable=False, index=True)
+    icd10_code = Column(_nocase_string(10), unique=True, nullable=False, index=True)
     short_desc = Column(String(100))
     long_desc = Column(Text)
     order_num = Column(Integer)
-    is_billable = Column(Boolean, default=True, index=True)
+    is_billable = Column(Boolean, default=True)  # the parser only loads billable codes
     source = Column(String(50), default="cms_icd10_pcs")
     source_year = Column(Integer)
 
+    __table_args__ = (
+        _trgm_index("ix_icd10_code_trgm", "icd10_code"),
+        _trgm_index("ix_icd10_short_desc_trgm", "short_desc"),
+        _trgm_index("ix_icd10_long_desc_trgm", "long_desc"),
+    )
+
 
 class MedicareUtilization(Base):
     __tablename__ = "medicare_utilization"
 
     id = Column(Integer, primary_key=True, index=True)
-    hcpcs_code = Column(String(10), nullable=False, index=True)
+    hcpcs_code = Column(String(10), nullable=False)  # leading column of ix_util_hcpcs_pos
     place_of_service = Column(String(1), default="O")
 
     total_providers = Column(Integer)
@@ -119,7 +222,7 @@ class DataSyncLog(Base):
     __tablename__ = "data_sync_log"
 
     id = Column(Integer, primary_key=True, index=True)
-    source_name = Column(String(50), nullable=False, index=True)
+    source_name = Column(String(50), nullable=False)
     started_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     status = Column(String(20), default="running")
@@ -129,3 +232,10 @@ class DataSyncLog(Base):
     error_message = Column(Text, nullable=True)
     source_url = Column(Text, nullable=True)
     source_hash = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        # Stages look up the latest completed sync; search ETags and
+        # /pipeline/status rank each source's runs by start time.
+        Index("ix_sync_source_status_done", "source_name", "status", "completed_at"),
+        Index("ix_sync_source_started", "source_name", "started_at"),
+    )
@@ -1,11 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from database import PipelineSession
+from .config import PFS_ZIP_URL, ICD10_ZIP_URL
+from .downloader import prefetch_zip
 from .pfs_parser import sync_pfs_data as sync_pfs
 from .hcpcs_parser import sync_hcpcs_data as sync_hcpcs
 from .icd10_parser import sync_icd10_data as sync_icd10
 from .utilization_parser import sync_utilization_data as sync_utilization
 
 
-def sync_all(db, force=False):
-    """Run all pipeline stages in order."""
+def _run_stage(stage, force):
+    """Run one stage on its own session; sessions are not shared across threads."""
+    db = PipelineSession()
+    try:
+        stage(db, force=force)
+    finally:
+        db.close()
+
+
+def sync_all(db, force=False, serial=False):
+    """
+    Run all pipeline stages.
+
+    PFS, HCPCS and ICD-10-PCS are independent, so they download and load
+    concurrently; utilization reads codes from the procedures table and
+    starts once PFS is done. SQLite allows only one writer at a time and each
+    stage holds its write transaction until it finishes, so on SQLite (or with
+    serial=True) the stages run one after another, with both CMS archives
+    downloading together in the background.
+    """
+    if serial or db.get_bind().dialect.name == "sqlite":
+        _sync_all_serial(db, force)
+        return
+
+    print("=== Syncing Medicare PFS, HCPCS Level II and ICD-10-PCS concurrently ===")
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        pfs = pool.submit(_run_stage, sync_pfs, force)
+        futures = {
+            pfs: "Medicare PFS RVU data",
+            pool.submit(_run_stage, sync_hcpcs, force): "HCPCS Level II codes",
+            pool.submit(_run_stage, sync_icd10, force): "ICD-10-PCS codes",
+        }
+        for future in as_completed(futures):
+            future.result()
+            print(f"\n=== Finished: {futures[future]} ===")
+            if future is pfs:
+                print("\n=== Starting: Medicare Utilization data ===")
+                utilization = pool.submit(_run_stage, sync_utilization, force)
+        utilization.result()
+        print("\n=== Finished: Medicare Utilization data ===")
+
+    print("\n=== Pipeline complete ===")
+
+
+def _sync_all_serial(db, force):
+    # Download both CMS archives side by side; ICD-10-PCS keeps downloading
+    # while PFS and HCPCS load
+    prefetch_zip(PFS_ZIP_URL)
+    prefetch_zip(ICD10_ZIP_URL)
+
     print("=== Stage 1/4: Medicare PFS RVU data ===")
     sync_pfs(db, force=force)
 
@@ -1,6 +1,8 @@
 """Pipeline configuration — URLs, constants, category mappings."""
 
 import os
+from bisect import bisect_right
+from functools import lru_cache
 
 # ── Download URLs ─────────────────────────────────────────────
 PFS_ZIP_URL = "https://www.cms.gov/files/zip/rvu26a-updated-12-29-2025.zip"
@@ -13,12 +15,18 @@ UTILIZATION_API_URL = (
 
 # ── File paths ────────────────────────────────────────────────
 PIPELINE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "pipeline_data")
+# Per-code utilization aggregates, kept until a sync completes (see --resume)
+UTILIZATION_CACHE_PATH = os.path.join(PIPELINE_DIR, "utilization_cache.db")
 
 # ── Batch / rate-limit settings ───────────────────────────────
 HCPCS_BATCH_SIZE = 500
 HCPCS_MAX_OFFSET = 10000
+HCPCS_FETCH_WORKERS = 8       # prefixes fetched concurrently
+HCPCS_API_INTERVAL = 0.1      # seconds between NLM API calls, across all workers
 UTILIZATION_BATCH_SIZE = 50
-UTILIZATION_API_DELAY = 0.5   # seconds between CMS API calls
+UTILIZATION_FETCH_WORKERS = 8  # most codes fetched concurrently
+UTILIZATION_API_DELAY = 0.1   # minimum seconds between CMS API calls, across all workers
+UTILIZATION_TARGET_LATENCY = 8.0  # slower CMS responses shrink concurrency
 DOWNLOAD_TIMEOUT = 120        # seconds
 
 SOURCE_YEAR = 2026
@@ -76,35 +84,44 @@ CATEGORY_RANGES = [
 ]
 
 
+# Parallel views of CATEGORY_RANGES for bisect; the ranges are sorted and disjoint.
+_RANGE_LOS = [lo for lo, _, _ in CATEGORY_RANGES]
+_RANGE_HIS = [hi for _, hi, _ in CATEGORY_RANGES]
+_RANGE_CATS = [cat for _, _, cat in CATEGORY_RANGES]
+
+# Non-numeric codes (A, B, C, E, G, etc.) are HCPCS Level II
+HCPCS_LEVEL2_CATEGORIES = {
+    "A": "HCPCS - Supplies",
+    "B": "HCPCS - Enteral/Parenteral",
+    "C": "HCPCS - Outpatient PPS",
+    "D": "HCPCS - Dental",
+    "E": "HCPCS - DME",
+    "G": "HCPCS - Procedures/Services",
+    "H": "HCPCS - Behavioral Health",
+    "J": "HCPCS - Drugs",
+    "K": "HCPCS - DME (Temporary)",
+    "L": "HCPCS - Orthotics/Prosthetics",
+    "M": "HCPCS - Quality Measures",
+    "P": "HCPCS - Laboratory",
+    "Q": "HCPCS - Temporary Codes",
+    "R": "HCPCS - Diagnostic Radiology",
+    "S": "HCPCS - Private Payer",
+    "T": "HCPCS - State Medicaid",
+    "U": "HCPCS - Coronavirus",
+    "V": "HCPCS - Vision/Hearing",
+}
+
+
+@lru_cache(maxsize=65536)
 def get_category_for_code(hcpcs_code: str) -> str:
-    """Map a numeric HCPCS/CPT code to a category."""
+    """Map a numeric HCPCS/CPT code to a category (pure, so results are memoized)."""
     try:
         num = int(hcpcs_code)
     except ValueError:
-        # Non-numeric codes (A, B, C, E, G, etc.) are HCPCS Level II
         prefix = hcpcs_code[0].upper() if hcpcs_code else ""
-        return {
-            "A": "HCPCS - Supplies",
-            "B": "HCPCS - Enteral/Parenteral",
-            "C": "HCPCS - Outpatient PPS",
-            "D": "HCPCS - Dental",
-            "E": "HCPCS - DME",
-            "G": "HCPCS - Procedures/Services",
-            "H": "HCPCS - Behavioral Health",
-            "J": "HCPCS - Drugs",
-            "K": "HCPCS - DME (Temporary)",
-            "L": "HCPCS - Orthotics/Prosthetics",
-            "M": "HCPCS - Quality Measures",
-            "P": "HCPCS - Laboratory",
-            "Q": "HCPCS - Temporary Codes",
-            "R": "HCPCS - Diagnostic Radiology",
-            "S": "HCPCS - Private Payer",
-            "T": "HCPCS - State Medicaid",
-            "U": "HCPCS - Coronavirus",
-            "V": "HCPCS - Vision/Hearing",
-        }.get(prefix, "Other")
+        return HCPCS_LEVEL2_CATEGORIES.get(prefix, "Other")
 
-    for lo, hi, cat in CATEGORY_RANGES:
-        if lo <= num <= hi:
-            return cat
+    i = bisect_right(_RANGE_LOS, num) - 1
+    if i >= 0 and num <= _RANGE_HIS[i]:
+        return _RANGE_CATS[i]
     return "Other"
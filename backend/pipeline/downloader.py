@@ -1,10 +1,109 @@
 """Shared utilities for downloading and extracting CMS data files."""
 
+import io
 import os
+import time
 import hashlib
 import zipfile
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from .config import PIPELINE_DIR, DOWNLOAD_TIMEOUT
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .config import DOWNLOAD_TIMEOUT, HCPCS_FETCH_WORKERS, UTILIZATION_FETCH_WORKERS
+
+# Archives up to this size stay in memory; larger ones spill to an anonymous
+# temp file that is deleted when the archive is closed.
+ZIP_SPOOL_BYTES = 64 * 1024 * 1024
+
+# Bytes per read from a streamed download; large reads keep the Python-level
+# loop (write, hash, progress) to a few hundred iterations per archive.
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Seconds between download progress updates.
+PROGRESS_INTERVAL = 0.25
+
+# Background ZIP downloads started by prefetch_zip, keyed by URL.
+_prefetch_pool = ThreadPoolExecutor(max_workers=2)
+_prefetched = {}
+
+# One keep-alive session for every pipeline HTTP call, so paginated API
+# requests reuse a TLS connection instead of handshaking each time. Each host
+# keeps one pooled connection per fetch worker, so none are discarded.
+# Rate limits and transient server errors are retried with exponential
+# backoff (honouring Retry-After) so one flaky response doesn't abort a sync.
+http = requests.Session()
+http.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=max(HCPCS_FETCH_WORKERS, UTILIZATION_FETCH_WORKERS),
+    max_retries=Retry(
+        total=5,
+        backoff_factor=1.0,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+    ),
+))
+
+
+class RateLimiter:
+    """Spaces calls at least `interval` seconds apart, across all threads."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AimdLimiter:
+    """
+    Caps concurrent calls with an additive-increase/multiplicative-decrease limit.
+
+    Each call that succeeds within target_latency raises the limit by
+    `increase`, up to `maximum`; a failed or slow call halves it, down to
+    `minimum`. The limit settles at what the remote API sustains instead of
+    a hand-picked fixed rate.
+    """
+
+    def __init__(self, maximum: int, target_latency: float, minimum: int = 1, increase: float = 0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target_latency = target_latency
+        self.increase = increase
+        self.limit = float(minimum)
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+        start = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self._in_flight -= 1
+                if ok and elapsed <= self.target_latency:
+                    self.limit = min(self.maximum, self.limit + self.increase)
+                else:
+                    self.limit = max(self.minimum, self.limit / 2)
+                self._cond.notify_all()
 
 
 def ensure_dir(path: str) -> str:
@@ -12,54 +111,83 @@ def ensure_dir(path: str) -> str:
     return path
 
 
-def compute_file_hash(filepath: str) -> str:
-    sha256 = hashlib.sha256()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            sha256.update(chunk)
-    return sha256.hexdigest()
-
-
-def download_file(url: str, dest_dir: str = None, filename: str = None) -> str:
-    """Download a file from url. Returns the local file path."""
-    dest_dir = dest_dir or ensure_dir(PIPELINE_DIR)
-    ensure_dir(dest_dir)
-
-    if not filename:
-        filename = url.rsplit("/", 1)[-1]
-    filepath = os.path.join(dest_dir, filename)
-
-    print(f"  Downloading {url} ...")
-    resp = requests.get(url, timeout=DOWNLOAD_TIMEOUT, stream=True)
+def _write_response(resp, out, hasher=None, progress=True):
+    """Copy a streamed response body into out, printing progress."""
+    total = int(resp.headers.get("content-length", 0)) if progress else 0
+    downloaded = 0
+    shown = 0
+    last_print = 0.0
+    for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+        out.write(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+        downloaded += len(chunk)
+        if total and time.monotonic() - last_print >= PROGRESS_INTERVAL:
+            _print_progress(downloaded, total)
+            shown, last_print = downloaded, time.monotonic()
+    if total and shown != downloaded:
+        _print_progress(downloaded, total)
+    if progress:
+        print()  # newline after progress
+
+
+def _print_progress(downloaded: int, total: int):
+    print(f"\r  Downloaded {downloaded / 1048576:.1f}MB / {total / 1048576:.1f}MB "
+          f"({downloaded * 100 // total}%)", end="", flush=True)
+
+
+def _download_zip(url: str, progress: bool = True):
+    """Stream url into a spooled temp file, hashing as it goes."""
+    resp = http.get(url, timeout=DOWNLOAD_TIMEOUT, stream=True)
     resp.raise_for_status()
 
-    total = int(resp.headers.get("content-length", 0))
-    downloaded = 0
-    with open(filepath, "wb") as f:
-        for chunk in resp.iter_content(chunk_size=65536):
-            f.write(chunk)
-            downloaded += len(chunk)
-            if total:
-                pct = downloaded * 100 // total
-                print(f"\r  Downloaded {downloaded // 1024}KB / {total // 1024}KB ({pct}%)", end="", flush=True)
-    print()  # newline after progress
-
-    return filepath
-
-
-def extract_zip(zip_path: str, dest_dir: str = None) -> list:
-    """Extract a ZIP file. Returns list of extracted file paths."""
-    dest_dir = dest_dir or os.path.dirname(zip_path)
-
-    with zipfile.ZipFile(zip_path, "r") as zf:
-        zf.extractall(dest_dir)
-        extracted = [os.path.join(dest_dir, name) for name in zf.namelist()]
-        print(f"  Extracted {len(extracted)} files from {os.path.basename(zip_path)}")
-        return extracted
-
-
-def download_and_extract(url: str, dest_dir: str = None) -> list:
-    """Download a ZIP file and extract it. Returns list of extracted paths."""
-    zip_path = download_file(url, dest_dir)
-    extracted = extract_zip(zip_path, dest_dir)
-    return extracted
+    sha256 = hashlib.sha256()
+    buf = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES)
+    try:
+        _write_response(resp, buf, sha256, progress)
+    except BaseException:
+        buf.close()
+        raise
+    buf.seek(0)
+    return buf, sha256.hexdigest()
+
+
+def prefetch_zip(url: str):
+    """
+    Start downloading a ZIP in the background; the next open_zip(url) uses it.
+
+    Lets a later stage's download overlap an earlier stage's parsing while
+    database writes stay on the caller's thread.
+    """
+    if url not in _prefetched:
+        print(f"  Prefetching {url} in the background ...")
+        _prefetched[url] = _prefetch_pool.submit(_download_zip, url, False)
+
+
+@contextmanager
+def open_zip(url: str):
+    """
+    Download a ZIP archive without writing it to the data directory.
+
+    The archive is hashed as it streams in, so callers can skip an unchanged
+    release before reading anything. Members are read straight from the
+    archive with open_member, which avoids an extract-to-disk pass.
+
+    Yields:
+        (zipfile.ZipFile, sha256 hex digest of the archive)
+    """
+    pending = _prefetched.pop(url, None)
+    if pending is not None:
+        print(f"  Using prefetched {url} ...")
+        buf, digest = pending.result()
+    else:
+        print(f"  Downloading {url} ...")
+        buf, digest = _download_zip(url)
+
+    with buf, zipfile.ZipFile(buf) as zf:
+        yield zf, digest
+
+
+def open_member(zf: zipfile.ZipFile, name: str):
+    """Open an archive member as text, decompressing as it is read."""
+    return io.TextIOWrapper(zf.open(name), encoding="utf-8", errors="replace")
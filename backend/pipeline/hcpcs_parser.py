@@ -8,15 +8,22 @@ The NLM API requires a non-empty search term for proper pagination,
 so we iterate by 2-character prefix (A0-A9, B0-B9, ..., V0-V9).
 """
 
-import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from models import HcpcsCode
-from .config import HCPCS_API_URL, HCPCS_BATCH_SIZE, SOURCE_YEAR, get_category_for_code
+from .config import (
+    HCPCS_API_URL, HCPCS_FETCH_WORKERS, HCPCS_API_INTERVAL, SOURCE_YEAR, get_category_for_code,
+)
+from .downloader import RateLimiter, http
 from .sync_log import is_sync_current, start_sync, complete_sync, fail_sync
+from .upsert import existing_keys, upsert_rows
 
 # HCPCS Level II prefixes: A, B, C, D, E, G, H, J, K, L, M, P, Q, R, S, T, U, V
 HCPCS_PREFIXES = "A B C D E G H J K L M P Q R S T U V".split()
 
+# Shared by every fetch thread so the NLM API sees the same request rate
+# no matter how many prefixes are in flight.
+_rate_limit = RateLimiter(HCPCS_API_INTERVAL)
+
 
 def _fetch_prefix(prefix: str, batch_size: int = 500) -> list:
     """Fetch all codes for a given 2-char prefix from the NLM API."""
@@ -32,7 +39,8 @@ def _fetch_prefix(prefix: str, batch_size: int = 500) -> list:
             "ef": "short_desc,long_desc,add_dt,term_dt",
         }
 
-        resp = requests.get(HCPCS_API_URL, params=params, timeout=30)
+        _rate_limit.wait()
+        resp = http.get(HCPCS_API_URL, params=params, timeout=30)
         resp.raise_for_status()
         data = resp.json()
 
@@ -61,8 +69,6 @@ def _fetch_prefix(prefix: str, batch_size: int = 500) -> list:
         if offset >= total_count:
             break
 
-        time.sleep(0.1)
-
     return all_codes
 
 
@@ -77,13 +83,17 @@ def sync_hcpcs_data(db, force=False):
     try:
         inserted = 0
         updated = 0
+        stored = {code for (code,) in existing_keys(db, (HcpcsCode.hcpcs_code,))}
         seen = set()
 
-        for letter in HCPCS_PREFIXES:
-            # Iterate digit suffixes: A0, A1, ..., A9
-            for digit in range(10):
-                prefix = f"{letter}{digit}"
-                codes = _fetch_prefix(prefix)
+        # Digit suffixes for each letter: A0, A1, ..., A9. Prefixes download
+        # concurrently; results come back in order and are written here, on
+        # the caller's thread, so the session is never shared.
+        prefixes = [f"{letter}{digit}" for letter in HCPCS_PREFIXES for digit in range(10)]
+        pool = ThreadPoolExecutor(max_workers=HCPCS_FETCH_WORKERS)
+        try:
+            for prefix, codes in zip(prefixes, pool.map(_fetch_prefix, prefixes)):
+                pending = []
 
                 for item in codes:
                     code = item["code"]
@@ -97,32 +107,29 @@ def sync_hcpcs_data(db, force=False):
 
                     category = get_category_for_code(code)
 
-                    existing = db.query(HcpcsCode).filter_by(hcpcs_code=code).first()
-                    if existing:
-                        existing.short_desc = item["short_desc"]
-                        existing.long_desc = item["long_desc"]
-                        existing.add_date = item["add_date"]
-                        existing.category = category
-                        existing.source_year = SOURCE_YEAR
+                    pending.append(dict(
+                        hcpcs_code=code,
+                        short_desc=item["short_desc"],
+                        long_desc=item["long_desc"],
+                        add_date=item["add_date"],
+                        term_date=item["term_date"],
+                        category=category,
+                        source_year=SOURCE_YEAR,
+                    ))
+                    if code in stored:
                         updated += 1
                     else:
-                        record = HcpcsCode(
-                            hcpcs_code=code,
-                            short_desc=item["short_desc"],
-                            long_desc=item["long_desc"],
-                            add_date=item["add_date"],
-                            term_date=item["term_date"],
-                            category=category,
-                            source_year=SOURCE_YEAR,
-                        )
-                        db.add(record)
                         inserted += 1
+                        stored.add(code)
 
-                db.flush()
-                time.sleep(0.1)
+                upsert_rows(db, HcpcsCode, pending, ("hcpcs_code",))
 
-            total = inserted + updated
-            print(f"  Prefix {letter}: {total} codes so far ({inserted} new, {updated} updated)", flush=True)
+                if prefix.endswith("9"):
+                    total = inserted + updated
+                    print(f"  Prefix {prefix[0]}: {total} codes so far ({inserted} new, {updated} updated)", flush=True)
+        finally:
+            # Drop queued fetches if a prefix fails, instead of waiting them out
+            pool.shutdown(cancel_futures=True)
 
         db.commit()
         total = inserted + updated
@@ -10,7 +10,9 @@ Usage:
   python3 -m pipeline.run_pipeline --source icd10      # only ICD-10-PCS
   python3 -m pipeline.run_pipeline --source utilization # only utilization stats
   python3 -m pipeline.run_pipeline --source utilization --limit 100  # first 100 codes
+  python3 -m pipeline.run_pipeline --source utilization --resume  # continue an interrupted run
   python3 -m pipeline.run_pipeline --force             # ignore idempotency checks
+  python3 -m pipeline.run_pipeline --serial            # run stages one at a time (always on SQLite)
 """
 
 import argparse
@@ -20,7 +22,7 @@ import os
 # Ensure backend/ is on the path
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from database import Base, engine, SessionLocal
+from database import PipelineSession, init_db
 from pipeline import sync_pfs, sync_hcpcs, sync_icd10, sync_utilization, sync_all
 
 
@@ -39,6 +41,16 @@ def main():
         action="store_true",
         help="Force re-sync even if data appears current",
     )
+    parser.add_argument(
+        "--serial",
+        action="store_true",
+        help="Run all stages one after another instead of concurrently",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Reuse codes already fetched by an interrupted run (utilization only)",
+    )
     parser.add_argument(
         "--limit",
         type=int,
@@ -48,12 +60,12 @@ def main():
     args = parser.parse_args()
 
     # Ensure all tables exist
-    Base.metadata.create_all(bind=engine)
+    init_db()
 
-    db = SessionLocal()
+    db = PipelineSession()
     try:
         if args.source == "all":
-            sync_all(db, force=args.force)
+            sync_all(db, force=args.force, serial=args.serial)
         elif args.source == "pfs":
             sync_pfs(db, force=args.force)
         elif args.source == "hcpcs":
@@ -61,7 +73,7 @@ def main():
         elif args.source == "icd10":
             sync_icd10(db, force=args.force)
         elif args.source == "utilization":
-            sync_utilization(db, force=args.force, limit=args.limit)
+            sync_utilization(db, force=args.force, limit=args.limit, resume=args.resume)
     except KeyboardInterrupt:
         print("\nInterrupted by user. Progress so far has been committed.")
     except Exception as e:
@@ -4,34 +4,33 @@ from datetime import datetime, timedelta
 from models import DataSyncLog
 
 
-def get_last_sync(db, source_name: str):
-    """Return the most recent sync log entry for a source, or None."""
+def get_last_completed_sync(db, source_name: str):
+    """Return the most recent successful sync for a source, or None."""
     return (
         db.query(DataSyncLog)
-        .filter_by(source_name=source_name)
-        .order_by(DataSyncLog.started_at.desc())
+        .filter_by(source_name=source_name, status="completed")
+        .order_by(DataSyncLog.completed_at.desc())
         .first()
     )
 
 
 def is_sync_current(db, source_name: str, max_age_days: int = 30) -> bool:
     """True if the last successful sync is within max_age_days."""
-    last = get_last_sync(db, source_name)
-    if not last or last.status != "completed":
-        return False
-    if not last.completed_at:
+    last = get_last_completed_sync(db, source_name)
+    if not last or not last.completed_at:
         return False
     return (datetime.utcnow() - last.completed_at) < timedelta(days=max_age_days)
 
 
 def is_hash_current(db, source_name: str, file_hash: str) -> bool:
-    """True if the last successful sync used the same file hash."""
-    last = get_last_sync(db, source_name)
-    return (
-        last is not None
-        and last.status == "completed"
-        and last.source_hash == file_hash
-    )
+    """
+    True if the last successful sync used the same file hash.
+
+    Stages call this after start_sync, so the newest row is the run in
+    progress; only completed runs are compared.
+    """
+    last = get_last_completed_sync(db, source_name)
+    return last is not None and last.source_hash == file_hash
 
 
 def start_sync(db, source_name: str, source_url: str = None) -> DataSyncLog:
@@ -0,0 +1,50 @@
+"""Bulk INSERT ... ON CONFLICT DO UPDATE helpers for the pipeline stages."""
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Rows per INSERT statement. Keeps each statement well under SQLite's
+# bound-parameter limit for the widest table (procedures, ~20 columns).
+UPSERT_BATCH_SIZE = 1000
+
+_DIALECT_INSERT = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def existing_keys(db, key_columns, *criteria) -> set:
+    """Key tuples already stored (optionally filtered), in one query (for insert/update counts)."""
+    return {tuple(row) for row in db.query(*key_columns).filter(*criteria).all()}
+
+
+def upsert_rows(db, model, rows: list, key_columns: tuple):
+    """
+    Insert rows, updating the non-key columns of any row whose key exists.
+
+    Args:
+        db: SQLAlchemy session
+        model: Mapped class whose table has a unique constraint on key_columns
+        rows: Dicts of column name -> value; a repeated key keeps its first row
+        key_columns: Names of the conflict-target columns
+    """
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    insert = _DIALECT_INSERT.get(dialect)
+    if insert is None:
+        raise NotImplementedError(f"Bulk upsert is not supported on {dialect}")
+
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        # One statement may not touch the same row twice (PostgreSQL rejects it),
+        # so collapse repeated keys within the batch, keeping the first row
+        # like the stages' own duplicate checks do.
+        unique = {}
+        for row in rows[start:start + UPSERT_BATCH_SIZE]:
+            unique.setdefault(tuple(row[name] for name in key_columns), row)
+        batch = list(unique.values())
+        stmt = insert(model.__table__).values(batch)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={name: stmt.excluded[name] for name in batch[0] if name not in key_columns},
+        )
+        db.execute(stmt)
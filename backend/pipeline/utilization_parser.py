@@ -8,20 +8,42 @@ to fetch per-provider rows, then aggregates into national statistics
 This is the longest-running pipeline step (~60-90 min for all codes).
 """
 
-import time
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+import orjson
 import requests
 from models import Procedure, MedicareUtilization
-from .config import UTILIZATION_API_URL, UTILIZATION_BATCH_SIZE, UTILIZATION_API_DELAY, SOURCE_YEAR
+from .config import (
+    UTILIZATION_API_URL, UTILIZATION_BATCH_SIZE, UTILIZATION_API_DELAY,
+    UTILIZATION_FETCH_WORKERS, UTILIZATION_TARGET_LATENCY, UTILIZATION_CACHE_PATH,
+    PIPELINE_DIR, SOURCE_YEAR,
+)
+from .downloader import AimdLimiter, RateLimiter, ensure_dir, http
 from .sync_log import is_sync_current, start_sync, complete_sync, fail_sync
+from .upsert import existing_keys, upsert_rows
 
 
-def _percentile(sorted_vals: list, pct: float) -> float:
-    """Compute a percentile from a pre-sorted list."""
-    if not sorted_vals:
-        return 0.0
-    idx = int(len(sorted_vals) * pct)
-    idx = min(idx, len(sorted_vals) - 1)
-    return sorted_vals[idx]
+# Conflict target: the unique ix_util_hcpcs_pos index
+UTILIZATION_KEY = ("hcpcs_code", "place_of_service")
+
+_rate_limit = RateLimiter(UTILIZATION_API_DELAY)
+# Workers in flight adapt between 1 and the pool size: a failed (429/5xx after
+# retries, timeout) or slow response halves the limit, fast ones grow it.
+_concurrency = AimdLimiter(UTILIZATION_FETCH_WORKERS, UTILIZATION_TARGET_LATENCY)
+
+
+# Per-provider fields read from each API row, in one C-level lookup
+_row_fields = itemgetter(
+    "Avg_Sbmtd_Chrg", "Avg_Mdcr_Alowd_Amt", "Avg_Mdcr_Pymt_Amt", "Tot_Srvcs", "Tot_Benes",
+)
+
+
+def _quartiles(sorted_vals: list) -> tuple:
+    """(p25, p75) of a non-empty pre-sorted list, rounded to cents."""
+    n = len(sorted_vals)
+    # n // 4 and 3n // 4 are always below n, so no clamping is needed
+    return round(sorted_vals[n // 4], 2), round(sorted_vals[n * 3 // 4], 2)
 
 
 def _fetch_and_aggregate(hcpcs_code: str) -> dict:
@@ -29,27 +51,36 @@ def _fetch_and_aggregate(hcpcs_code: str) -> dict:
     Query the CMS utilization API for a single HCPCS code and compute
     national aggregate statistics from per-provider rows.
 
-    Returns dict with aggregated stats, or None if no data found.
+    Returns dict with aggregated stats, or None if the API has no data for
+    the code. Transient failures (timeouts, 429/5xx once the session's retries
+    are used up, malformed bodies) raise instead, so they are never recorded
+    as "no data".
     """
     params = {
         "filter[HCPCS_Cd]": hcpcs_code,
         "size": 5000,
     }
 
-    try:
-        resp = requests.get(UTILIZATION_API_URL, params=params, timeout=30)
+    with _concurrency.slot():
+        _rate_limit.wait()
+        resp = http.get(UTILIZATION_API_URL, params=params, timeout=30)
+        if resp.status_code == 404:
+            return None
         resp.raise_for_status()
-        rows = resp.json()
-    except Exception:
-        return None
+    rows = orjson.loads(resp.content)
 
     if not rows or not isinstance(rows, list):
         return None
 
-    # Separate by place of service (F=Facility, O=Office)
+    # Separate by place of service (F=Facility, O=Office) in one pass
+    by_pos = {"F": [], "O": []}
+    for r in rows:
+        bucket = by_pos.get(r.get("Place_Of_Srvc"))
+        if bucket is not None:
+            bucket.append(r)
+
     results = {}
-    for pos in ("F", "O"):
-        pos_rows = [r for r in rows if r.get("Place_Of_Srvc") == pos]
+    for pos, pos_rows in by_pos.items():
         if not pos_rows:
             continue
 
@@ -61,12 +92,13 @@ def _fetch_and_aggregate(hcpcs_code: str) -> dict:
 
         for r in pos_rows:
             try:
-                chrg = float(r.get("Avg_Sbmtd_Chrg", 0) or 0)
-                alowd = float(r.get("Avg_Mdcr_Alowd_Amt", 0) or 0)
-                pymt = float(r.get("Avg_Mdcr_Pymt_Amt", 0) or 0)
-                srvcs = int(r.get("Tot_Srvcs", 0) or 0)
-                benes = int(r.get("Tot_Benes", 0) or 0)
-            except (ValueError, TypeError):
+                chrg, alowd, pymt, srvcs, benes = _row_fields(r)
+                chrg = float(chrg or 0)
+                alowd = float(alowd or 0)
+                pymt = float(pymt or 0)
+                srvcs = int(srvcs or 0)
+                benes = int(benes or 0)
+            except (KeyError, ValueError, TypeError):
                 continue
 
             if chrg > 0:
@@ -83,6 +115,8 @@ def _fetch_and_aggregate(hcpcs_code: str) -> dict:
 
         submitted_charges.sort()
         allowed_amounts.sort()
+        p25_submitted, p75_submitted = _quartiles(submitted_charges)
+        p25_allowed, p75_allowed = _quartiles(allowed_amounts) if allowed_amounts else (None, None)
 
         results[pos] = {
             "total_providers": len(pos_rows),
@@ -91,16 +125,65 @@ def _fetch_and_aggregate(hcpcs_code: str) -> dict:
             "avg_submitted_charge": round(sum(submitted_charges) / len(submitted_charges), 2),
             "avg_allowed_amount": round(sum(allowed_amounts) / len(allowed_amounts), 2) if allowed_amounts else None,
             "avg_medicare_payment": round(sum(payment_amounts) / len(payment_amounts), 2) if payment_amounts else None,
-            "p25_submitted_charge": round(_percentile(submitted_charges, 0.25), 2),
-            "p75_submitted_charge": round(_percentile(submitted_charges, 0.75), 2),
-            "p25_allowed_amount": round(_percentile(allowed_amounts, 0.25), 2) if allowed_amounts else None,
-            "p75_allowed_amount": round(_percentile(allowed_amounts, 0.75), 2) if allowed_amounts else None,
+            "p25_submitted_charge": p25_submitted,
+            "p75_submitted_charge": p75_submitted,
+            "p25_allowed_amount": p25_allowed,
+            "p75_allowed_amount": p75_allowed,
         }
 
     return results if results else None
 
 
-def sync_utilization_data(db, force=False, limit=None):
+def _write_batch(db, rows: list) -> tuple:
+    """
+    Upsert one batch of aggregated rows.
+
+    Existing keys are looked up for just this batch's codes, in one query.
+
+    Returns:
+        (inserted, updated) row counts
+    """
+    if not rows:
+        return 0, 0
+    codes = {row["hcpcs_code"] for row in rows}
+    stored = existing_keys(
+        db,
+        (MedicareUtilization.hcpcs_code, MedicareUtilization.place_of_service),
+        MedicareUtilization.hcpcs_code.in_(codes),
+    )
+    # Count keys, not rows: upsert_rows writes a repeated key once
+    keys = {(row["hcpcs_code"], row["place_of_service"]) for row in rows}
+    updated = len(keys & stored)
+    upsert_rows(db, MedicareUtilization, rows, UTILIZATION_KEY)
+    return len(keys) - updated, updated
+
+
+def _open_cache():
+    """
+    Open the on-disk cache of per-code aggregates for the current source year.
+
+    Every fetched aggregate is saved here as soon as it arrives, so a run that
+    dies part way can be resumed without re-querying the CMS API. A completed
+    sync clears its year's entries.
+    """
+    ensure_dir(PIPELINE_DIR)
+    cache = sqlite3.connect(UTILIZATION_CACHE_PATH)
+    cache.execute(
+        "CREATE TABLE IF NOT EXISTS utilization_cache ("
+        " hcpcs_code TEXT, source_year INTEGER, agg BLOB,"
+        " PRIMARY KEY (hcpcs_code, source_year))"
+    )
+    return cache
+
+
+def _load_cached(cache) -> dict:
+    rows = cache.execute(
+        "SELECT hcpcs_code, agg FROM utilization_cache WHERE source_year = ?", (SOURCE_YEAR,)
+    )
+    return {code: orjson.loads(agg) for code, agg in rows}
+
+
+def sync_utilization_data(db, force=False, limit=None, resume=False):
     """
     Fetch utilization data for each HCPCS code in the procedures table.
 
@@ -108,8 +191,9 @@ def sync_utilization_data(db, force=False, limit=None):
         db: SQLAlchemy session
         force: If True, re-sync even if data is current
         limit: If set, only process this many codes (useful for testing)
+        resume: If True, reuse aggregates cached by an earlier, unfinished run
     """
-    if not force and is_sync_current(db, "utilization", max_age_days=30):
+    if not (force or resume) and is_sync_current(db, "utilization", max_age_days=30):
         print("  Utilization data is current (synced within 30 days). Use --force to re-import.")
         return
 
@@ -132,58 +216,96 @@ def sync_utilization_data(db, force=False, limit=None):
 
     print(f"  Processing utilization data for {total_codes} HCPCS codes ...")
 
+    cache = _open_cache()
+    cached = _load_cached(cache) if resume else {}
+    if cached:
+        print(f"  Resuming: {len(cached)} codes already fetched by an earlier run")
+
     log = start_sync(db, "utilization", UTILIZATION_API_URL)
     try:
         inserted = 0
         updated = 0
         processed = 0
         skipped = 0
-
-        for i, code in enumerate(all_codes):
-            agg = _fetch_and_aggregate(code)
-
-            if not agg:
-                skipped += 1
-            else:
-                for pos, stats in agg.items():
-                    existing = (
-                        db.query(MedicareUtilization)
-                        .filter_by(hcpcs_code=code, place_of_service=pos)
-                        .first()
-                    )
-
-                    if existing:
-                        for key, val in stats.items():
-                            setattr(existing, key, val)
-                        existing.source_year = SOURCE_YEAR
-                        updated += 1
+        failed = 0
+        pending = []
+
+        # Codes are fetched and aggregated by a thread pool; results come back
+        # in order and are written here, on the caller's thread, so the
+        # session is never shared.
+        pool = ThreadPoolExecutor(max_workers=UTILIZATION_FETCH_WORKERS)
+        try:
+            fetched = iter([
+                pool.submit(_fetch_and_aggregate, code) for code in all_codes if code not in cached
+            ])
+            for code in all_codes:
+                if code in cached:
+                    agg = cached[code]
+                    if not agg:
+                        skipped += 1
+                else:
+                    try:
+                        agg = next(fetched).result()
+                    except (requests.RequestException, orjson.JSONDecodeError) as e:
+                        # Not cached, so --resume retries just these codes
+                        print(f"  {code}: fetch failed ({e})", flush=True)
+                        failed += 1
+                        agg = None
                     else:
-                        record = MedicareUtilization(
+                        if not agg:
+                            skipped += 1
+                        cache.execute(
+                            "INSERT OR REPLACE INTO utilization_cache VALUES (?, ?, ?)",
+                            (code, SOURCE_YEAR, orjson.dumps(agg)),
+                        )
+
+                if agg:
+                    for pos, stats in agg.items():
+                        pending.append(dict(
                             hcpcs_code=code,
                             place_of_service=pos,
                             source_year=SOURCE_YEAR,
                             **stats,
-                        )
-                        db.add(record)
-                        inserted += 1
-
-            processed += 1
-
-            if processed % UTILIZATION_BATCH_SIZE == 0:
-                db.flush()
-                pct = processed * 100 // total_codes
-                print(f"  [{pct}%] Processed {processed}/{total_codes} codes "
-                      f"({inserted} new, {updated} updated, {skipped} no data)", flush=True)
-
-            time.sleep(UTILIZATION_API_DELAY)
-
+                        ))
+
+                processed += 1
+
+                if processed % UTILIZATION_BATCH_SIZE == 0:
+                    new, changed = _write_batch(db, pending)
+                    inserted += new
+                    updated += changed
+                    pending = []
+                    # Commit per batch: bounded transactions, and a failure
+                    # only rolls back the batch in progress. The progress
+                    # count commits with the rows, so API ETags move too.
+                    log.records_processed = processed
+                    db.commit()
+                    cache.commit()
+                    pct = processed * 100 // total_codes
+                    print(f"  [{pct}%] Processed {processed}/{total_codes} codes "
+                          f"({inserted} new, {updated} updated, {skipped} no data, {failed} failed)", flush=True)
+        finally:
+            # Drop queued fetches if the loop stops early (error or Ctrl-C)
+            pool.shutdown(cancel_futures=True)
+
+        new, changed = _write_batch(db, pending)
+        inserted += new
+        updated += changed
         db.commit()
         print(f"  Done: {processed} codes processed, {inserted} inserted, "
-              f"{updated} updated, {skipped} no data")
+              f"{updated} updated, {skipped} no data, {failed} failed")
         complete_sync(db, log, processed, inserted, updated)
+        if failed:
+            # Keep the cache so a resumed run only re-fetches the failed codes
+            print(f"  {failed} codes failed; run with --source utilization --resume to retry them.")
+        else:
+            cache.execute("DELETE FROM utilization_cache WHERE source_year = ?", (SOURCE_YEAR,))
 
     except Exception as e:
         db.rollback()
         fail_sync(db, log, str(e))
         print(f"  ERROR: {e}")
         raise
+    finally:
+        cache.commit()
+        cache.close()
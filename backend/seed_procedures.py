@@ -12,11 +12,13 @@ Run once:
   cd backend && python seed_procedures.py
 """
 
-from database import Base, engine, SessionLocal
+from sqlalchemy import insert
+from database import SessionLocal, init_db
 from models import Procedure
+from pipeline.sync_log import start_sync, complete_sync
 
 # fmt: off
-PROCEDURES = [
+_RAW_PROCEDURES = [
     # ── Evaluation & Management — Office Visits ──────────────────
     ("99202", "Office visit, new patient, low complexity",               "Office Visits",   75,    120,   280),
     ("99203", "Office visit, new patient, moderate complexity",          "Office Visits",  112,    180,   380),
@@ -223,9 +225,16 @@ PROCEDURES = [
 ]
 # fmt: on
 
+# One entry per CPT code; a repeated code keeps its first row (99213 is listed
+# under both Office Visits and OB/GYN).
+PROCEDURES_BY_CODE = {}
+for _row in _RAW_PROCEDURES:
+    PROCEDURES_BY_CODE.setdefault(_row[0], _row)
+PROCEDURES = tuple(PROCEDURES_BY_CODE.values())
+
 
 def seed():
-    Base.metadata.create_all(bind=engine)
+    init_db()
     db = SessionLocal()
 
     existing = db.query(Procedure).count()
@@ -234,23 +243,23 @@ def seed():
         db.close()
         return
 
-    seen = set()
-    records = []
-    for cpt_code, description, category, medicare_rate, typical_low, typical_high in PROCEDURES:
-        if cpt_code in seen:
-            continue
-        seen.add(cpt_code)
-        records.append(Procedure(
+    records = [
+        dict(
             cpt_code=cpt_code,
             description=description,
             category=category,
             medicare_rate=float(medicare_rate),
             typical_low=float(typical_low),
             typical_high=float(typical_high),
-        ))
+        )
+        for cpt_code, description, category, medicare_rate, typical_low, typical_high in PROCEDURES
+    ]
 
-    db.add_all(records)
-    db.commit()
+    # One executemany INSERT; no ORM objects or unit-of-work flush needed.
+    # The sync-log entry lets the API's ETags see the new rows.
+    log = start_sync(db, "seed")
+    db.execute(insert(Procedure), records)
+    complete_sync(db, log, len(records), len(records))
     print(f"Seeded {len(records)} procedures.")
     db.close()
 
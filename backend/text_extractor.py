@@ -2,36 +2,274 @@
 Text extraction utilities for medical bills.
 Supports PDF and image files (JPG, PNG).
 """
-import pdfplumber
+import pypdfium2 as pdfium
 from PIL import Image
 import pytesseract
 import os
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+
+logger = logging.getLogger("medicheck.ocr")
+
+# Threads used to OCR scanned PDF pages. Tesseract runs as a subprocess,
+# so threads overlap fine without a process pool. The pool is shared by all
+# requests in the process, so concurrent uploads queue for the same workers
+# instead of each starting OCR_WORKERS Tesseract processes of their own.
+# By default the cores are split between gunicorn's worker processes.
+OCR_WORKERS = int(os.getenv(
+    "OCR_WORKERS", max(1, (os.cpu_count() or 1) // int(os.getenv("GUNICORN_WORKERS", "1")))
+))
+_ocr_pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+# DPI used when rasterizing a page for OCR. Tesseract time grows with pixel
+# count, so pages go through at 150 DPI first and are re-rendered at 300 DPI
+# when that reads poorly. Small print at 150 DPI tends to come back as plenty
+# of garbled text rather than little text, so the retry keys on Tesseract's
+# mean word confidence (0-100) as well as on length.
+OCR_RESOLUTION = 150
+OCR_RETRY_RESOLUTION = 300
+OCR_MIN_CONFIDENCE = 75
+# A born-digital document averages well over this much text per page. Below
+# it, the PDF is treated as a scan (blank pages, or just stamped page numbers)
+# and every page this short gets OCR'd; a born-digital document only OCRs
+# pages with no text layer at all, so a short footer or totals page is kept.
+MIN_TEXT_LAYER_CHARS = 100
+PDF_POINTS_PER_INCH = 72
+# Pages rendered before their OCR is collected; bounds the rendered images
+# held in memory (~2 MB per page at 150 DPI grayscale).
+PDF_SLAB_PAGES = 32
+# PDFium is not thread-safe, even across separate documents, and uploads are
+# extracted on many request threads at once. Every call into it holds this.
+_pdfium_lock = threading.Lock()
+# Pages are joined with a form feed so the analyzer can chunk long bills by page.
+PAGE_BREAK = "\f"
+
+# OCR text keyed by a SHA-256 of the image's pixels, so a re-uploaded scan or a
+# page repeated across bills skips Tesseract. OCR'd bills carry patient
+# details, so the cache is opt-in: off unless OCR_CACHE_TTL (seconds) is set
+# above 0, and held in process memory only.
+OCR_CACHE_TTL = int(os.getenv("OCR_CACHE_TTL", "0"))
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "256"))
+_ocr_cache = TTLCache(maxsize=OCR_CACHE_SIZE, ttl=OCR_CACHE_TTL) if OCR_CACHE_TTL > 0 else None
+_ocr_cache_lock = threading.Lock()
+
+# Leading bytes of each supported format, checked instead of trusting the
+# uploaded file's extension.
+FILE_SIGNATURES = (
+    (b"%PDF-", "pdf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+)
+
 
 class TextExtractor:
     """Extract text from various file formats."""
     
+    @staticmethod
+    def sniff_file_type(head):
+        """
+        Identify a file from its leading bytes.
+        
+        Args:
+            head: The first few bytes of the file (8 are enough)
+            
+        Returns:
+            'pdf', 'png' or 'jpg', or None for anything else
+        """
+        for signature, file_type in FILE_SIGNATURES:
+            if head.startswith(signature):
+                return file_type
+        return None
+
+    @staticmethod
+    def _to_grayscale(image):
+        """
+        Flatten an image to 8-bit grayscale before OCR.
+
+        Tesseract binarizes internally, so colour only adds bytes to write out
+        and hash. Transparent areas are put on white first so they don't come
+        out black.
+        """
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image)
+        return image.convert("L")
+
+    @staticmethod
+    def _tesseract(image):
+        """
+        OCR an image in one Tesseract run.
+
+        Returns:
+            (text, mean word confidence); text has one line per OCR'd line
+            and a blank line between paragraphs, like image_to_string()
+        """
+        data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+        lines = []
+        confidences = []
+        last = None
+        for block, par, line, word, conf in zip(
+            data["block_num"], data["par_num"], data["line_num"], data["text"], data["conf"],
+        ):
+            word = word.strip()
+            if not word:
+                continue
+            if (block, par, line) == last:
+                lines[-1] += " " + word
+            else:
+                if last is not None and (block, par) != last[:2]:
+                    lines.append("")
+                lines.append(word)
+                last = (block, par, line)
+            if float(conf) >= 0:
+                confidences.append(float(conf))
+        confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        return "\n".join(lines), confidence
+
+    @staticmethod
+    def _ocr(image):
+        """(text, mean confidence) for a PIL image, reused for identical pixels."""
+        if _ocr_cache is None:
+            return TextExtractor._tesseract(image)
+
+        digest = hashlib.sha256(f"{image.mode}{image.size}".encode())
+        digest.update(image.tobytes())
+        key = digest.hexdigest()
+        with _ocr_cache_lock:
+            result = _ocr_cache.get(key)
+        if result is None:
+            result = TextExtractor._tesseract(image)
+            with _ocr_cache_lock:
+                _ocr_cache[key] = result
+        return result
+
+    @staticmethod
+    def _render(page, dpi):
+        """
+        Rasterize a PDFium page to a grayscale PIL image at the given DPI.
+
+        Call with _pdfium_lock held. The pixels are copied out and the bitmap
+        closed, so no PDFium memory is freed later on another thread.
+        """
+        bitmap = page.render(scale=dpi / PDF_POINTS_PER_INCH, grayscale=True)
+        image = bitmap.to_pil().copy()
+        bitmap.close()
+        return image
+
+    @staticmethod
+    def _render_page(pdf, index, dpi):
+        """Rasterize page index of an open document, holding _pdfium_lock."""
+        with _pdfium_lock:
+            page = pdf[index]
+            image = TextExtractor._render(page, dpi)
+            page.close()
+        return image
+
+    @staticmethod
+    def _ocr_result(job, index):
+        """A page's (text, confidence) from its OCR job, or None if OCR failed."""
+        try:
+            return job.result()
+        except Exception:
+            logger.warning("OCR failed on page %d; keeping any text layer", index + 1, exc_info=True)
+            return None
+
     @staticmethod
     def extract_from_pdf(file_path):
         """
-        Extract text from a PDF file using pdfplumber.
+        Extract text from a PDF file using PDFium.
+        
+        Every page's text layer is read first. Pages without a usable one
+        (scanned bills) are rasterized and OCR'd with Tesseract on the shared
+        OCR pool; results keep page order. A scanned page whose OCR comes back
+        short or low-confidence is rendered again at a higher DPI and
+        re-OCR'd. A page whose OCR fails keeps its text-layer text.
         
         Args:
-            file_path: Path to the PDF file
+            file_path: Path to the PDF file, or a binary file-like object
             
         Returns:
             Extracted text as a string
         """
-        text = ""
+        texts = []
+        retried = 0
         try:
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
+            with _pdfium_lock:
+                pdf = pdfium.PdfDocument(file_path)
+                page_count = len(pdf)
+            try:
+                for i in range(page_count):
+                    # One page at a time under the lock, so concurrent
+                    # uploads interleave
+                    with _pdfium_lock:
+                        page = pdf[i]
+                        textpage = page.get_textpage()
+                        texts.append(textpage.get_text_range().strip())
+                        textpage.close()
+                        page.close()
+
+                born_digital = sum(map(len, texts)) >= MIN_TEXT_LAYER_CHARS * page_count
+                scanned = [
+                    i for i, text in enumerate(texts)
+                    if not text or (not born_digital and len(text) < MIN_TEXT_LAYER_CHARS)
+                ]
+
+                # Scanned pages go through in slabs so at most one slab of
+                # rendered images is held at once, however long the document is.
+                for start in range(0, len(scanned), PDF_SLAB_PAGES):
+                    ocr_jobs = {
+                        i: _ocr_pool.submit(TextExtractor._ocr, TextExtractor._render_page(pdf, i, OCR_RESOLUTION))
+                        for i in scanned[start:start + PDF_SLAB_PAGES]
+                    }
+
+                    retry_jobs = {}
+                    first_confidence = {}
+                    for i, job in ocr_jobs.items():
+                        result = TextExtractor._ocr_result(job, i)
+                        if result is None:
+                            continue
+                        ocr_text, confidence = result
+                        ocr_text = ocr_text.strip()
+                        had_text_layer = bool(texts[i])
+                        used_ocr = len(ocr_text) > len(texts[i])
+                        if used_ocr:
+                            texts[i] = ocr_text
+                        # A page that has a text layer already says what it
+                        # says; only pages read purely by OCR get a sharper pass
+                        if not had_text_layer and (
+                            len(ocr_text) < MIN_TEXT_LAYER_CHARS or confidence < OCR_MIN_CONFIDENCE
+                        ):
+                            first_confidence[i] = confidence if used_ocr else None
+                            image = TextExtractor._render_page(pdf, i, OCR_RETRY_RESOLUTION)
+                            retry_jobs[i] = _ocr_pool.submit(TextExtractor._ocr, image)
+
+                    for i, job in retry_jobs.items():
+                        result = TextExtractor._ocr_result(job, i)
+                        if result is None:
+                            continue
+                        ocr_text, confidence = result
+                        ocr_text = ocr_text.strip()
+                        # Garbled text can outrun a clean read in length, so the
+                        # sharper render beats the first OCR on confidence
+                        if first_confidence[i] is None:
+                            better = len(ocr_text) > len(texts[i])
+                        else:
+                            better = bool(ocr_text) and confidence >= first_confidence[i]
+                        if better:
+                            texts[i] = ocr_text
+                    retried += len(retry_jobs)
+                if scanned:
+                    logger.info("OCR'd %d pages, %d re-rendered at %d DPI",
+                                len(scanned), retried, OCR_RETRY_RESOLUTION)
+            finally:
+                with _pdfium_lock:
+                    pdf.close()
         except Exception as e:
             raise Exception(f"Error extracting text from PDF: {str(e)}")
         
-        return text.strip()
+        return PAGE_BREAK.join(t for t in texts if t).strip()
     
     @staticmethod
     def extract_from_image(file_path):
@@ -39,14 +277,16 @@ class TextExtractor:
         Extract text from an image file using Tesseract OCR.
         
         Args:
-            file_path: Path to the image file
+            file_path: Path to the image file, or a binary file-like object
             
         Returns:
             Extracted text as a string
         """
         try:
-            image = Image.open(file_path)
-            text = pytesseract.image_to_string(image)
+            # Close the decoded upload as soon as its grayscale copy exists
+            with Image.open(file_path) as image:
+                gray = TextExtractor._to_grayscale(image)
+            text, _ = _ocr_pool.submit(TextExtractor._ocr, gray).result()
             return text.strip()
         except Exception as e:
             raise Exception(f"Error extracting text from image: {str(e)}")
@@ -57,17 +297,22 @@ class TextExtractor:
         Extract text from a file based on its type.
         
         Args:
-            file_path: Path to the file
+            file_path: Path to the file, or a binary file-like object
             file_type: Type of file ('pdf', 'jpg', 'png', 'jpeg')
             
         Returns:
             Extracted text as a string
         """
-        file_type = file_type.lower()
-        
-        if file_type == 'pdf':
-            return TextExtractor.extract_from_pdf(file_path)
-        elif file_type in ['jpg', 'jpeg', 'png']:
-            return TextExtractor.extract_from_image(file_path)
-        else:
-            raise ValueError(f"Unsupported file type: {file_type}")
\ No newline at end of file
+        extract = _EXTRACTORS.get(file_type.lower())
+        if extract is None:
+            raise ValueError(f"Unsupported file type: {file_type}")
+        return extract(file_path)
+
+
+# File type -> extraction function, used by TextExtractor.extract_text
+_EXTRACTORS = {
+    'pdf': TextExtractor.extract_from_pdf,
+    'jpg': TextExtractor.extract_from_image,
+    'jpeg': TextExtractor.extract_from_image,
+    'png': TextExtractor.extract_from_image,
+}